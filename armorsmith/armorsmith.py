@@ -1,11 +1,24 @@
+import asyncio
+import json
 import logging
 import os
-from collections import namedtuple, OrderedDict, defaultdict
-from copy import deepcopy
+import random as random_module
+import re
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple, OrderedDict, defaultdict, Counter
+from contextlib import contextmanager, ExitStack
 from datetime import datetime
-from random import choice
+from io import BytesIO
+from functools import lru_cache
+from itertools import islice
+from random import getrandbits, shuffle
+from types import MappingProxyType
 
 import discord
+import numpy as np
 from __main__ import send_cmd_help
 from cogs.utils.chat_formatting import pagify, box
 from cogs.utils.dataIO import dataIO
@@ -14,7 +27,54 @@ from discord.ext import commands
 from .utils import checks
 
 DEFAULTS = {
-    "HP": 50
+    "HP": 50,
+    "BATTLE_LOG": "summary"
+}
+
+# Write-behind tuning: flush at most every FLUSH_INTERVAL seconds, or sooner once
+# FLUSH_THRESHOLD mutations have piled up.
+FLUSH_INTERVAL = 10
+FLUSH_THRESHOLD = 25
+
+# Seconds between checks of items.json for changes
+CATALOG_POLL_INTERVAL = 5
+
+# "XdY", optionally exploding ("!"), with a +/- modifier and "adv"/"dis" suffix,
+# or a flat amount such as the Blowgun's "1"
+DICE_PATTERN = re.compile(r"^\s*(?:(?P<count>\d+)d(?P<sides>[1-9]\d*)(?P<exploding>!)?)?\s*"
+                          r"(?P<modifier>[+-]?\s*\d+)?\s*(?P<mode>adv|dis)?\s*$", re.IGNORECASE)
+
+# Most times one exploding die can roll again
+EXPLODE_LIMIT = 10
+
+# Rating given to new leaderboard entries, and the most one duel can move it
+ELO_START = 1000
+ELO_K = 32
+
+# Duels after which a fight is called on remaining hp, and the sample size for [p]fight odds
+MAX_ROUNDS = 1000
+ODDS_SIMULATIONS = 100000
+# Chance of still standing below which a knockout_distribution stops adding rounds
+KNOCKOUT_PRECISION = 1e-12
+
+# The live battle log edits its message at most LIVE_MAX_EDITS times, LIVE_EDIT_INTERVAL
+# seconds apart, showing the last LIVE_LINES lines
+LIVE_MAX_EDITS = 10
+LIVE_EDIT_INTERVAL = 1.5
+LIVE_LINES = 8
+
+# Minimum trigram similarity for a misspelled item name to still resolve
+FUZZY_CUTOFF = 0.4
+
+# Which of BACKENDS stores inventories, scores and settings
+STORAGE_BACKEND = "sqlite"
+
+RECORD_KINDS = ("inventory", "leaderboard")
+
+# A top-level key whose value has this field is a legacy record keyed by user id
+LEGACY_MARKERS = {
+    "inventory": "stash",
+    "leaderboard": "wins"
 }
 
 
@@ -22,6 +82,10 @@ class ArmorException(Exception):
     pass
 
 
+class CatalogError(ArmorException):
+    pass
+
+
 class InventoryException(Exception):
     pass
 
@@ -35,7 +99,15 @@ class NoAccount(InventoryException):
 
 
 class ItemNotFound(InventoryException):
-    pass
+    def __init__(self, suggestions=()):
+        super().__init__()
+        self.suggestions = list(suggestions)
+
+    def did_you_mean(self, message):
+        """message, followed by the closest item names if there are any"""
+        if self.suggestions:
+            message += " Did you mean {}?".format(", ".join("`{}`".format(name) for name in self.suggestions))
+        return message
 
 
 class SameSenderAndReceiver(InventoryException):
@@ -46,16 +118,132 @@ class ItemNotEquiped(InventoryException):
     pass
 
 
+class Dice(namedtuple('Dice', 'count sides modifier exploding mode')):
+    """A dice expression, compiled once from strings like "2d6", "1d8+2",
+    "1d6!" (exploding), "1d20 adv" or "1d20 dis" (advantage/disadvantage),
+    or a flat amount such as "1".
+
+    Exploding dice roll again and add whenever they show their highest face,
+    up to EXPLODE_LIMIT extra times. Advantage rolls the whole expression
+    twice and keeps the higher total; disadvantage keeps the lower."""
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def parse(cls, expression):
+        match = DICE_PATTERN.match(expression)
+        if match is None or not (match.group("count") or match.group("modifier")):
+            raise ValueError("Invalid dice expression {!r}".format(expression))
+        if match.group("count") and match.group("modifier") and match.group("modifier")[0] not in "+-":
+            raise ValueError("Dice modifiers need a sign, as in {!r}".format("1d8+2"))
+        count = int(match.group("count") or 0)
+        sides = int(match.group("sides") or 0)
+        modifier = int((match.group("modifier") or "0").replace(" ", ""))
+        if match.group("count") and not count:
+            raise ValueError("Dice expressions need at least one die, as in {!r}".format("1d6"))
+        if count + modifier < 0:
+            # A negative roll would heal the defender
+            raise ValueError("{!r} can roll below 0".format(expression))
+        return cls(count, sides, modifier, bool(match.group("exploding")), (match.group("mode") or "").lower())
+
+    @property
+    def maximum(self):
+        """Highest total without explosions"""
+        return self.count * self.sides + self.modifier
+
+    def roll(self, rng=None):
+        """Rolls the expression once, drawing from a random.Random (the random module's by default).
+
+        Single rolls stay in pure Python: a NumPy call per roll costs far more
+        than the roll itself."""
+        rand = (rng or random_module).random
+        total = self._roll_total(rand)
+        if self.mode == "adv":
+            total = max(total, self._roll_total(rand))
+        elif self.mode == "dis":
+            total = min(total, self._roll_total(rand))
+        return total
+
+    def _roll_total(self, rand):
+        sides = self.sides
+        total = self.modifier
+        for _ in range(self.count):
+            face = int(rand() * sides) + 1
+            total += face
+            explosions = 0
+            while self.exploding and face == sides > 1 and explosions < EXPLODE_LIMIT:
+                face = int(rand() * sides) + 1
+                total += face
+                explosions += 1
+        return total
+
+    def roll_many(self, rng, n):
+        """Rolls the expression n times at once from a NumPy Generator, returning an array of totals"""
+        totals = self._roll_totals(rng, n)
+        if self.mode == "adv":
+            np.maximum(totals, self._roll_totals(rng, n), out=totals)
+        elif self.mode == "dis":
+            np.minimum(totals, self._roll_totals(rng, n), out=totals)
+        return totals
+
+    def _roll_totals(self, rng, n):
+        if not self.count:
+            return np.full(n, self.modifier, dtype=np.int32)
+        if self.count == 1:
+            faces = rng.integers(1, self.sides + 1, size=n, dtype=np.int32)
+            totals = faces.copy() if self.exploding else faces
+        else:
+            faces = rng.integers(1, self.sides + 1, size=(n, self.count), dtype=np.int32)
+            totals = faces.sum(axis=1, dtype=np.int32)
+        if self.exploding and self.sides > 1:
+            rows = np.flatnonzero(faces == self.sides) if self.count == 1 else np.nonzero(faces == self.sides)[0]
+            for _ in range(EXPLODE_LIMIT):
+                if not rows.size:
+                    break
+                extra = rng.integers(1, self.sides + 1, size=rows.size, dtype=np.int32)
+                np.add.at(totals, rows, extra)
+                rows = rows[extra == self.sides]
+        if self.modifier:
+            totals += self.modifier
+        return totals
+
+    def distribution(self):
+        """Returns the lowest total and an array of the probability of each total from there up"""
+        if not self.count:
+            return self.modifier, np.ones(1)
+        die = np.full(self.sides, 1 / self.sides)
+        if self.exploding and self.sides > 1:
+            # Built from the last allowed reroll outwards; index i is a total of i + 1
+            for _ in range(EXPLODE_LIMIT):
+                exploded = np.zeros(self.sides + die.size)
+                exploded[:self.sides - 1] = 1 / self.sides
+                exploded[self.sides:] = die / self.sides
+                die = exploded
+        probabilities = die
+        for _ in range(self.count - 1):
+            probabilities = np.convolve(probabilities, die)
+        if self.mode:
+            below = np.cumsum(probabilities)
+            below = below ** 2 if self.mode == "adv" else 1 - (1 - below) ** 2
+            probabilities = np.diff(below, prepend=0.0)
+        return self.count + self.modifier, probabilities
+
+    def __str__(self):
+        s = "{}d{}".format(self.count, self.sides) if self.count else ""
+        if self.exploding:
+            s += "!"
+        if self.modifier:
+            s += "{:+d}".format(self.modifier) if self.count else str(self.modifier)
+        if self.mode:
+            s += " " + self.mode
+        return s
+
+
 class Item(namedtuple('Item', 'name cost')):
     @staticmethod
-    def _roll_dice(dice):
-        """Returns the value of rolling XdY dice
+    def _roll_dice(dice, rng=None):
+        """Returns the value of rolling a dice expression
         Ex: _roll_dice("2d6") returns the result of rolling 2 six-sided die"""
-        (num_rolls, dice_sides) = map(int, dice.split('d'))
-        val = 0
-        for roll in range(num_rolls):
-            val += choice(range(1, dice_sides + 1))
-        return val
+        return Dice.parse(dice).roll(rng)
 
     def __str__(self):
         s = ""
@@ -69,8 +257,12 @@ class Item(namedtuple('Item', 'name cost')):
 
 
 class Weapon(namedtuple('Weapon', Item._fields + ('hit_dice',)), Item):
-    def damage_roll(self):
-        return self._roll_dice(self.hit_dice)
+    @property
+    def dice(self):
+        return Dice.parse(self.hit_dice)
+
+    def damage_roll(self, rng=None):
+        return self.dice.roll(rng)
 
     def get_type(self):
         return "weapon"
@@ -85,52 +277,750 @@ class Armor(namedtuple('Armor', Item._fields + ('damage_reduction',)), Item):
 
 
 class HealPotion(namedtuple('HealPotion', Item._fields + ('heal_dice',)), Item):
-    def healing_roll(self):
-        return self._roll_dice(self.heal_dice)
+    @property
+    def dice(self):
+        return Dice.parse(self.heal_dice)
+
+    def healing_roll(self, rng=None):
+        return self.dice.roll(rng)
 
     def get_type(self):
         return "potion"
 
 
+class Loadout(namedtuple('Loadout', 'weapon reduction potion')):
+    """What the combat engine needs from a fighter's equipment"""
+
+    @classmethod
+    def from_equipment(cls, weapon, armor, potion):
+        return cls(weapon.dice,
+                   int(armor.damage_reduction) if armor else 0,
+                   potion.dice if potion else None)
+
+
+class DuelResult(namedtuple('DuelResult', 'author_won hp_author hp_user potions_used events')):
+    """Outcome of one duel. potions_used is (author, user); events lists the duel's DuelEvents."""
+
+
+def _fight(author, user, hp, n, rng, events=None):
+    """Runs n duels between two loadouts side by side.
+
+    Each round the author strikes, then the user strikes back, even if the
+    author's blow was lethal; a fighter dropping to 0 hp drinks their potion
+    if they still have one. Duels still running after MAX_ROUNDS go to the
+    fighter with more hp left, the user on a tie. Returns the final hp and
+    remaining-potion arrays of both sides.
+
+    Only the duels still running are kept in the working arrays; finished
+    ones are copied out, so late rounds touch few elements."""
+    fighters = (author, user)
+    hp_left = [np.full(n, hp, dtype=np.int32), np.full(n, hp, dtype=np.int32)]
+    potions = [np.full(n, author.potion is not None), np.full(n, user.potion is not None)]
+    final_hp = [np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32)]
+    final_potions = [np.empty(n, dtype=bool), np.empty(n, dtype=bool)]
+    running = np.arange(n)
+    for round_number in range(1, MAX_ROUNDS + 1):
+        for attacker, defender in ((0, 1), (1, 0)):
+            damage = fighters[attacker].weapon.roll_many(rng, running.size)
+            if events is not None:
+                critical = int(damage[0]) >= fighters[attacker].weapon.maximum
+            if fighters[defender].reduction:
+                damage -= fighters[defender].reduction
+                np.maximum(damage, 0, out=damage)
+            hp_left[defender] -= damage
+            if events is not None:
+                events.append(DuelEvent(round_number, "hit", attacker, int(damage[0]), critical))
+            if fighters[defender].potion is not None:
+                drinking = np.flatnonzero((hp_left[defender] <= 0) & potions[defender])
+                if drinking.size:
+                    healing = fighters[defender].potion.roll_many(rng, drinking.size)
+                    hp_left[defender][drinking] += healing
+                    potions[defender][drinking] = False
+                    if events is not None:
+                        events.append(DuelEvent(round_number, "potion", defender, int(healing[0]), False))
+        alive = (hp_left[0] > 0) & (hp_left[1] > 0)
+        if alive.all():
+            continue
+        keep = np.flatnonzero(alive)
+        done = np.flatnonzero(~alive)
+        finished = running.take(done)
+        for side in (0, 1):
+            final_hp[side][finished] = hp_left[side].take(done)
+            final_potions[side][finished] = potions[side].take(done)
+            hp_left[side] = hp_left[side].take(keep)
+            potions[side] = potions[side].take(keep)
+        running = running.take(keep)
+        if not running.size:
+            break
+    for side in (0, 1):
+        final_hp[side][running] = hp_left[side]
+        final_potions[side][running] = potions[side]
+    return final_hp, final_potions
+
+
+def knockout_distribution(hp, weapon, reduction, potion):
+    """Probabilities of when a fighter starting on hp is knocked out by weapon.
+
+    Returns an array whose first MAX_ROUNDS entries are the chance of going
+    down in each round, followed by the chance of still standing on each hp
+    from 0 up after MAX_ROUNDS. Follows _fight's rules: a fighter at 0 hp or
+    below drinks their potion straight away, and is out if that doesn't lift
+    them above 0."""
+    lowest, probabilities = weapon.distribution()
+    damage = np.bincount(np.maximum(np.arange(lowest, lowest + probabilities.size) - reduction, 0),
+                         weights=probabilities)
+    if potion is not None:
+        heal_lowest, healing = potion.distribution()
+    # Index h holds the chance of standing on h hp, with and without the potion in hand
+    size = hp + 1 if potion is None else max(hp, heal_lowest + healing.size - 1) + 1
+    holding = np.zeros(size)
+    holding[hp] = 1.0
+    drunk = np.zeros(size)
+    if potion is None:
+        holding, drunk = drunk, holding
+    knocked_out = np.zeros(MAX_ROUNDS)
+    reach = damage.size - 1
+    for round_index in range(MAX_ROUNDS):
+        # After the hit, index i stands for i - reach hp
+        hit_holding = np.convolve(holding, damage[::-1])
+        hit_drunk = np.convolve(drunk, damage[::-1])
+        falling = hit_holding[:reach + 1].copy()
+        down = hit_drunk[:reach + 1].sum()
+        holding = hit_holding[reach:reach + size]
+        drunk = hit_drunk[reach:reach + size]
+        holding[0] = drunk[0] = 0.0
+        if potion is not None and falling.any():
+            # Standing on -reach..0 hp, then healed
+            healed = np.convolve(falling, healing)
+            start = heal_lowest - reach
+            values = np.arange(start, start + healed.size)
+            down += healed[values <= 0].sum()
+            drunk = drunk + np.bincount(values[values > 0], weights=healed[values > 0], minlength=size)[:size]
+        knocked_out[round_index] = down
+        if holding.sum() + drunk.sum() < KNOCKOUT_PRECISION:
+            break
+    return np.concatenate((knocked_out, holding + drunk))
+
+
+def simulate_duels(author, user, hp, n, rng):
+    """Returns a boolean array of which of n simulated duels the author won.
+
+    A fighter's hp only depends on the rolls made against them, so the
+    rounds in which the two sides go down are independent. Each side's
+    knockout_distribution is computed exactly, and the n duels are drawn from
+    the pair, following _fight's rules: whoever goes down first loses, the
+    user losing if both go down in the same round, and after MAX_ROUNDS the
+    fighter with more hp left wins, the user on a tie."""
+    outcomes = []
+    for defender, attacker in ((author, user), (user, author)):
+        cdf = np.cumsum(knockout_distribution(hp, attacker.weapon, defender.reduction, defender.potion))
+        drawn = np.searchsorted(cdf, rng.random(n) * cdf[-1], side="right")
+        outcomes.append(np.minimum(drawn, cdf.size - 1))
+    author_out, user_out = outcomes
+    # Below MAX_ROUNDS an outcome is a knockout round; from there on, MAX_ROUNDS plus the hp left
+    return (user_out <= author_out) & ((user_out < MAX_ROUNDS) | (author_out > user_out))
+
+
+def run_duel(author, user, hp, rng):
+    """Runs a single duel a round at a time, recording its events"""
+    events = []
+    (hp_author, hp_user), potions = _fight(author, user, hp, 1, rng, events)
+    author_won = bool(hp_user[0] <= 0 or (hp_author[0] > 0 and hp_author[0] > hp_user[0]))
+    potions_used = (author.potion is not None and not potions[0][0],
+                    user.potion is not None and not potions[1][0])
+    return DuelResult(author_won, int(hp_author[0]), int(hp_user[0]), potions_used, events)
+
+
+class DuelEvent(namedtuple('DuelEvent', 'round kind side amount critical')):
+    """One step of a duel: a "hit" dealing amount damage, or a "potion" healing amount.
+    side is 0 for the author and 1 for the user; critical marks a weapon's best roll."""
+
+    def describe(self, names):
+        if self.kind == "hit":
+            return "{} hit {} for {} damage!{}".format(names[self.side], names[1 - self.side], self.amount,
+                                                       " Critical!" if self.critical else "")
+        return "{} used a potion".format(names[self.side])
+
+
+def describe_outcome(result, names):
+    if result.author_won:
+        return "{} beat {} in a duel with {} hp remaining!".format(names[0], names[1], result.hp_author)
+    return "{} beat {} in a duel with {} hp remaining!".format(names[1], names[0], result.hp_user)
+
+
+class BattleRenderer:
+    """Posts a finished duel to a channel.
+
+    Every renderer sends a fixed number of messages however long the fight
+    ran, so long duels can't flood a channel or the rate limits."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def render(self, channel, names, hp, result, seed):
+        raise NotImplementedError
+
+
+class SummaryRenderer(BattleRenderer):
+    """One message with the totals of each side"""
+
+    async def render(self, channel, names, hp, result, seed):
+        rounds = result.events[-1].round if result.events else 0
+        msg = describe_outcome(result, names) + "\n"
+        msg += "Rounds: {}\n".format(rounds)
+        for side in (0, 1):
+            hits = [e.amount for e in result.events if e.kind == "hit" and e.side == side]
+            crits = sum(1 for e in result.events if e.kind == "hit" and e.side == side and e.critical)
+            healing = sum(e.amount for e in result.events if e.kind == "potion" and e.side == side)
+            msg += "{}: {} damage dealt, biggest hit {}, {} crits{}\n".format(
+                names[side], sum(hits), max(hits, default=0), crits,
+                ", potion healed {}".format(healing) if result.potions_used[side] else "")
+        await self.bot.send_message(channel, box(msg, lang="py"))
+
+
+class FileRenderer(BattleRenderer):
+    """The full log as one attached text file, with the outcome as the message"""
+
+    async def render(self, channel, names, hp, result, seed):
+        log = "\n".join(event.describe(names) for event in result.events)
+        log += "\n{}\nSeed: {}\n".format(describe_outcome(result, names), seed)
+        await self.bot.send_file(channel, BytesIO(log.encode("utf-8")), filename="duel.txt",
+                                 content=describe_outcome(result, names))
+
+
+class LiveRenderer(BattleRenderer):
+    """One message, edited as the fight plays out.
+
+    The duel is split into at most LIVE_MAX_EDITS frames, each edited in at
+    least LIVE_EDIT_INTERVAL seconds after the last."""
+
+    async def render(self, channel, names, hp, result, seed):
+        events = result.events
+        frame_size = max(1, -(-len(events) // LIVE_MAX_EDITS))
+        hp_left = [hp, hp]
+        lines = []
+        message = await self.bot.send_message(channel, box("{} vs {}".format(*names), lang="py"))
+        for start in range(0, len(events), frame_size):
+            for event in events[start:start + frame_size]:
+                if event.kind == "hit":
+                    hp_left[1 - event.side] -= event.amount
+                else:
+                    hp_left[event.side] += event.amount
+                lines.append(event.describe(names))
+            await asyncio.sleep(LIVE_EDIT_INTERVAL)
+            await self.bot.edit_message(message, self._frame(names, hp_left, events[start].round, lines))
+        lines.append(describe_outcome(result, names))
+        await self.bot.edit_message(message, self._frame(names, hp_left, events[-1].round if events else 0, lines))
+
+    @staticmethod
+    def _frame(names, hp_left, round_number, lines):
+        frame = "Round {}: {} {} hp, {} {} hp\n\n".format(round_number, names[0], hp_left[0], names[1], hp_left[1])
+        return box(frame + "\n".join(lines[-LIVE_LINES:]), lang="py")
+
+
+BATTLE_RENDERERS = OrderedDict([
+    ("summary", SummaryRenderer),
+    ("file", FileRenderer),
+    ("live", LiveRenderer)
+])
+
+
+class WriteBehind:
+    """Coalesces saves and persists them from a background task.
+
+    Mutations call mark_dirty(); the task persists every `interval` seconds,
+    or as soon as `threshold` mutations are pending. Subclasses implement
+    _persist() (awaited from the task) and _persist_sync() (used on close)."""
+
+    def __init__(self, bot, interval=FLUSH_INTERVAL, threshold=FLUSH_THRESHOLD):
+        self.bot = bot
+        self.interval = interval
+        self.threshold = threshold
+        self.dirty = 0
+        self._held = 0
+        self._wake = asyncio.Event()
+        self._task = self.bot.loop.create_task(self._flush_loop())
+
+    def mark_dirty(self):
+        self.dirty += 1
+        if self.dirty >= self.threshold and not self._held:
+            self._wake.set()
+
+    @contextmanager
+    def hold(self):
+        """Holds off flushing inside the block, then flushes everything it changed at once"""
+        self._held += 1
+        try:
+            yield
+        finally:
+            self._held -= 1
+            if not self._held and self.dirty:
+                self._wake.set()
+
+    async def _flush_loop(self):
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+                await self.flush()
+        except asyncio.CancelledError:
+            pass
+
+    async def flush(self):
+        if not self.dirty or self._held:
+            return
+        pending = self.dirty
+        self.dirty = 0
+        try:
+            await self._persist()
+        except asyncio.CancelledError:
+            self.dirty += pending
+            raise
+        except Exception:
+            # Anything escaping here would end the flush task and silently stop every later save
+            logger.exception("Could not persist armorsmith data")
+            self.dirty += pending
+
+    def close(self):
+        """Stops the flush task and synchronously persists any pending changes."""
+        self._task.cancel()
+        if self.dirty:
+            self.dirty = 0
+            self._persist_sync()
+
+    async def _persist(self):
+        raise NotImplementedError
+
+    def _persist_sync(self):
+        raise NotImplementedError
+
+
+class JsonWriter(WriteBehind):
+    """Writes a whole JSON document off the event loop.
+
+    Writes go to a temporary file which is fsynced and renamed over the target,
+    so a crash mid-write never leaves a truncated document behind. Snapshots
+    are numbered, and a write that reaches the lock after a newer snapshot
+    was written is skipped, so close() can't be undone by a write still
+    running in the executor."""
+
+    def __init__(self, bot, file_path, data, **kwargs):
+        self.file_path = file_path
+        self.data = data
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._written = 0
+        super().__init__(bot, **kwargs)
+
+    def _snapshot(self):
+        # Serialized on the loop so the write thread never sees a half-mutated dict
+        self._generation += 1
+        return self._generation, json.dumps(self.data, indent=4, sort_keys=True, separators=(',', ' : '))
+
+    def _write(self, generation, payload):
+        tmp_path = "{}.tmp".format(self.file_path)
+        with self._lock:
+            if generation <= self._written:
+                return
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+            self._written = generation
+
+    async def _persist(self):
+        await self.bot.loop.run_in_executor(None, self._write, *self._snapshot())
+
+    def _persist_sync(self):
+        self._write(*self._snapshot())
+
+
+class SqliteCommitter(WriteBehind):
+    """Groups row updates into one transaction per flush.
+
+    Statements run immediately on the connection, so reads see them straight
+    away; only the commit is deferred. In WAL mode with synchronous=NORMAL a
+    commit only appends to the log, which keeps it cheap enough for the loop.
+    The automatic checkpoint is disabled, because it would fsync the database
+    inside the commit; instead the log is checkpointed after each flush, from
+    a second connection in the executor."""
+
+    def __init__(self, bot, conn, db_path, **kwargs):
+        self.conn = conn
+        self.db_path = db_path
+        self.conn.execute("PRAGMA wal_autocheckpoint=0")
+        self._checkpointer = None
+        self._checkpoint_lock = threading.Lock()
+        super().__init__(bot, **kwargs)
+
+    def _checkpoint(self):
+        with self._checkpoint_lock:
+            if self._checkpointer is None:
+                self._checkpointer = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._checkpointer.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    async def _persist(self):
+        self.conn.commit()
+        await self.bot.loop.run_in_executor(None, self._checkpoint)
+
+    def _persist_sync(self):
+        self.conn.commit()
+        self._checkpoint()
+
+    def close(self):
+        super().close()
+        with self._checkpoint_lock:
+            if self._checkpointer is not None:
+                self._checkpointer.close()
+                self._checkpointer = None
+
+
+class JsonBackend:
+    """Keeps each kind of record in one JSON document keyed by server id, then user id.
+
+    Documents may also hold legacy records keyed directly by user id, left
+    over from before accounts were split per server. Records are handed out
+    as stored, without copying, so callers must replace them through put()
+    rather than edit them."""
+
+    def __init__(self, bot, data_path):
+        self.bot = bot
+        self.documents = {}
+        self.writers = {}
+        for kind in RECORD_KINDS:
+            file_path = os.path.join(data_path, "{}.json".format(kind))
+            self.documents[kind] = dataIO.load_json(file_path)
+            self.writers[kind] = JsonWriter(bot, file_path, self.documents[kind])
+        self.settings_path = os.path.join(data_path, "settings.json")
+        self.settings = dataIO.load_json(self.settings_path)
+
+    def get(self, kind, server_id, user_id):
+        try:
+            return self.documents[kind][server_id][user_id]
+        except KeyError:
+            return None
+
+    def get_legacy(self, kind, user_id):
+        return self.documents[kind].get(user_id)
+
+    def put(self, kind, server_id, user_id, record):
+        self.documents[kind].setdefault(server_id, {})[user_id] = record
+        self.writers[kind].mark_dirty()
+
+    def get_server(self, kind, server_id):
+        return self.documents[kind].get(server_id, {})
+
+    def server_ids(self, kind):
+        return list(self.documents[kind].keys())
+
+    def wipe(self, kind, server_id):
+        self.documents[kind][server_id] = {}
+        self.writers[kind].mark_dirty()
+
+    def batch(self):
+        """Groups the block's changes into a single write of each document"""
+        stack = ExitStack()
+        for writer in self.writers.values():
+            stack.enter_context(writer.hold())
+        return stack
+
+    def load_settings(self):
+        return self.settings
+
+    def put_settings(self, server_id, settings):
+        self.settings[server_id] = settings
+        dataIO.save_json(self.settings_path, self.settings)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class SqliteBackend:
+    """Stores records in SQLite, one row per (server_id, user_id).
+
+    Updates touch only the affected row, so save cost no longer grows with
+    the number of users. The first time the database is opened, any existing
+    JSON documents are imported."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS inventory (
+            server_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            name TEXT,
+            created_at TEXT,
+            stash TEXT NOT NULL,
+            equipment TEXT NOT NULL,
+            PRIMARY KEY (server_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            server_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            name TEXT,
+            wins INTEGER NOT NULL DEFAULT 0,
+            losses INTEGER NOT NULL DEFAULT 0,
+            elo REAL NOT NULL DEFAULT 1000,
+            created_at TEXT,
+            PRIMARY KEY (server_id, user_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS legacy (
+            kind TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (kind, user_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS settings (
+            server_id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    COLUMNS = {
+        "inventory": ("name", "created_at", "stash", "equipment"),
+        "leaderboard": ("name", "wins", "losses", "elo", "created_at")
+    }
+    JSON_COLUMNS = {"stash", "equipment"}
+
+    def __init__(self, bot, data_path):
+        self.bot = bot
+        self.data_path = data_path
+        db_path = os.path.join(data_path, "armorsmith.db")
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self._upgrade_schema()
+        if self._get_meta("json_migrated") is None:
+            self.migrate_json()
+        self.writer = SqliteCommitter(bot, self.conn, db_path)
+
+    def _upgrade_schema(self):
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(leaderboard)")]
+        if "elo" not in columns:
+            self.conn.execute("ALTER TABLE leaderboard ADD COLUMN elo REAL NOT NULL DEFAULT {}".format(ELO_START))
+            self.conn.commit()
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _to_record(self, kind, row):
+        record = {}
+        for column, value in zip(self.COLUMNS[kind], row):
+            if column in self.JSON_COLUMNS:
+                value = json.loads(value, object_pairs_hook=OrderedDict)
+            record[column] = value
+        return record
+
+    def _to_row(self, kind, record):
+        row = []
+        for column in self.COLUMNS[kind]:
+            value = record.get(column)
+            if column in self.JSON_COLUMNS:
+                value = json.dumps(value)
+            elif column == "elo":
+                value = record.get("elo", ELO_START)
+            row.append(value)
+        return row
+
+    def get(self, kind, server_id, user_id):
+        row = self.conn.execute(
+            "SELECT {} FROM {} WHERE server_id = ? AND user_id = ?".format(", ".join(self.COLUMNS[kind]), kind),
+            (server_id, user_id)).fetchone()
+        return self._to_record(kind, row) if row else None
+
+    def get_legacy(self, kind, user_id):
+        row = self.conn.execute("SELECT data FROM legacy WHERE kind = ? AND user_id = ?", (kind, user_id)).fetchone()
+        return json.loads(row[0], object_pairs_hook=OrderedDict) if row else None
+
+    def _put(self, kind, server_id, user_id, record):
+        columns = self.COLUMNS[kind]
+        self.conn.execute(
+            "INSERT OR REPLACE INTO {} (server_id, user_id, {}) VALUES (?, ?, {})".format(
+                kind, ", ".join(columns), ", ".join("?" * len(columns))),
+            [server_id, user_id] + self._to_row(kind, record))
+
+    def put(self, kind, server_id, user_id, record):
+        self._put(kind, server_id, user_id, record)
+        self.writer.mark_dirty()
+
+    def get_server(self, kind, server_id):
+        rows = self.conn.execute(
+            "SELECT user_id, {} FROM {} WHERE server_id = ?".format(", ".join(self.COLUMNS[kind]), kind),
+            (server_id,))
+        return {row[0]: self._to_record(kind, row[1:]) for row in rows}
+
+    def server_ids(self, kind):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT server_id FROM {}".format(kind))]
+
+    def wipe(self, kind, server_id):
+        self.conn.execute("DELETE FROM {} WHERE server_id = ?".format(kind), (server_id,))
+        self.writer.mark_dirty()
+
+    def batch(self):
+        """Groups the block's changes into a single commit"""
+        return self.writer.hold()
+
+    def load_settings(self):
+        return {row[0]: json.loads(row[1]) for row in self.conn.execute("SELECT server_id, data FROM settings")}
+
+    def put_settings(self, server_id, settings):
+        self.conn.execute("INSERT OR REPLACE INTO settings (server_id, data) VALUES (?, ?)",
+                          (server_id, json.dumps(settings)))
+        self.writer.mark_dirty()
+
+    def migrate_json(self):
+        """Imports inventory.json, leaderboard.json and settings.json in one transaction.
+
+        Top-level entries carrying a record's fields directly (rather than a
+        mapping of user ids) are pre-server-split legacy records, and are kept
+        so create_account and create_entry can still recover them."""
+        for kind in RECORD_KINDS:
+            file_path = os.path.join(self.data_path, "{}.json".format(kind))
+            if not dataIO.is_valid_json(file_path):
+                continue
+            for key, value in dataIO.load_json(file_path).items():
+                if LEGACY_MARKERS[kind] in value:
+                    self.conn.execute("INSERT OR REPLACE INTO legacy (kind, user_id, data) VALUES (?, ?, ?)",
+                                      (kind, key, json.dumps(value)))
+                    continue
+                for user_id, record in value.items():
+                    self._put(kind, key, user_id, record)
+        settings_path = os.path.join(self.data_path, "settings.json")
+        if dataIO.is_valid_json(settings_path):
+            for server_id, settings in dataIO.load_json(settings_path).items():
+                self.conn.execute("INSERT OR REPLACE INTO settings (server_id, data) VALUES (?, ?)",
+                                  (server_id, json.dumps(settings)))
+        self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)",
+                          (datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),))
+        self.conn.commit()
+
+    def close(self):
+        self.writer.close()
+        self.conn.close()
+
+
+BACKENDS = {
+    "json": JsonBackend,
+    "sqlite": SqliteBackend
+}
+
+
 class Account:
-    def __init__(self, id, name, stash, equipment, created_at, server, member):
+    """Read-only view of an inventory record.
+
+    Nothing is copied when a view is made: it wraps the record as stored.
+    Inventory never edits a stored record in place, it stores an edited copy
+    instead, so a view keeps showing the account as it was when fetched."""
+    __slots__ = ("id", "server", "_record")
+
+    def __init__(self, id, server, record):
         self.id = id
-        self.name = name
-        self.stash = stash
-        self.created_at = created_at
         self.server = server
-        self.member = member
-        self.equipment = equipment
+        self._record = record
+
+    @property
+    def name(self):
+        return self._record["name"]
+
+    @property
+    def stash(self):
+        return MappingProxyType(self._record["stash"])
+
+    @property
+    def equipment(self):
+        return MappingProxyType(self._record["equipment"])
+
+    @property
+    def created_at(self):
+        return datetime.strptime(self._record["created_at"], "%Y-%m-%d %H:%M:%S")
+
+    @property
+    def member(self):
+        return self.server.get_member(self.id)
+
+    def has_item(self, item):
+        return item.name in self._record["stash"]
+
+    def is_equipped(self, item):
+        equipped = self._record["equipment"][item.get_type()]
+        return equipped is not None and equipped[0] == item.name
 
     def get_equipment(self):
-        if self.equipment["weapon"]:
-            weapon = Weapon(*self.equipment["weapon"])
+        equipment = self._record["equipment"]
+        if equipment["weapon"]:
+            weapon = Weapon(*equipment["weapon"])
         else:
             weapon = None
-        if self.equipment["armor"]:
-            armor = Armor(*self.equipment["armor"])
+        if equipment["armor"]:
+            armor = Armor(*equipment["armor"])
         else:
             armor = None
-        if self.equipment["potion"]:
-            potion = HealPotion(*self.equipment["potion"])
+        if equipment["potion"]:
+            potion = HealPotion(*equipment["potion"])
         else:
             potion = None
         return (weapon, armor, potion)
 
 
+class Score:
+    """Read-only view of a leaderboard record."""
+    __slots__ = ("id", "server", "_record")
+
+    def __init__(self, id, server, record):
+        self.id = id
+        self.server = server
+        self._record = record
+
+    @property
+    def name(self):
+        return self._record["name"]
+
+    @property
+    def wins(self):
+        return self._record["wins"]
+
+    @property
+    def losses(self):
+        return self._record["losses"]
+
+    @property
+    def elo(self):
+        return self._record.get("elo", ELO_START)
+
+    @property
+    def win_rate(self):
+        return win_rate(self._record)
+
+    @property
+    def created_at(self):
+        return datetime.strptime(self._record["created_at"], "%Y-%m-%d %H:%M:%S")
+
+    @property
+    def member(self):
+        return self.server.get_member(self.id)
+
+
 class Inventory:
-    def __init__(self, bot, file_path):
+    def __init__(self, bot, storage):
         self.bot = bot
-        self.accounts = dataIO.load_json(file_path)
+        self.storage = storage
 
     def create_account(self, user):
         server = user.server
         if not self.account_exists(user):
-            if server.id not in self.accounts:
-                self.accounts[server.id] = {}
-            if user.id in self.accounts:  # Legacy account
-                stash = self.accounts[user.id]["stash"]
-                equipment = self.accounts[user.id]["equipment"]
+            legacy = self.storage.get_legacy("inventory", user.id)
+            if legacy is not None:  # Legacy account
+                stash = OrderedDict(legacy["stash"])
+                equipment = dict(legacy["equipment"])
             else:
                 stash = OrderedDict()
                 equipment = {
@@ -144,197 +1034,448 @@ class Inventory:
                        "created_at": timestamp,
                        "equipment": equipment
                        }
-            self.accounts[server.id][user.id] = account
-            self._save_inventory()
+            self.storage.put("inventory", server.id, user.id, account)
             return self.get_account(user)
         else:
             raise AccountAlreadyExists()
 
     def account_exists(self, user):
-        try:
-            self._get_account(user)
-        except NoAccount:
-            return False
-        return True
+        return self.storage.get("inventory", user.server.id, user.id) is not None
 
     def has_item(self, user, item):
-        account = self._get_account(user)
-        stash = account["stash"]
-        if item.name in stash.keys():
-            return True
-        else:
-            return False
+        return self.get_account(user).has_item(item)
 
     def equipped_item(self, user, item):
-        account = self._get_account(user)
-        equipment = account["equipment"]
-        if equipment[item.get_type()][0] == item.name:
-            return True
-        return False
+        return self.get_account(user).is_equipped(item)
 
     def remove_item(self, user, item):
-        server = user.server
-        account = self._get_account(user)
-        stash = account["stash"]
-        equipment = account["equipment"]
-        if self.has_item(user, item):
-            del stash[item.name]
-            # TODO: Make this work
-            if self.equipped_item(user, item):
-                equipment[item.get_type()] = None
-            self.accounts[server.id][user.id] = account
-            self._save_inventory()
-        else:
-            raise ItemNotFound()
+        with self._edit_account(user) as account:
+            self._remove_item(account, item)
+
+    def discard_item(self, user, item):
+        """Removes item if the user still has it, returning whether they did"""
+        try:
+            self.remove_item(user, item)
+        except (ItemNotFound, NoAccount):
+            return False
+        return True
 
     def give_item(self, user, item):
-        server = user.server
-        account = self._get_account(user)
-        stash = account["stash"]
-        stash[item.name] = item
-        self.accounts[server.id][user.id] = account
-        self._save_inventory()
+        with self._edit_account(user) as account:
+            account["stash"][item.name] = item
 
     def transfer_item(self, sender, receiver, item):
-        if sender is receiver:
+        if sender is receiver or sender.id == receiver.id:
             raise SameSenderAndReceiver()
-        if self.account_exists(sender) and self.account_exists(receiver):
-            if not self.has_item(sender, item):
-                raise ItemNotFound()
-            self.remove_item(sender, item)
-            self.give_item(receiver, item)
-        else:
+        if not self.account_exists(receiver):
             raise NoAccount()
+        with self._edit_account(sender) as sender_account, self._edit_account(receiver) as receiver_account:
+            receiver_account["stash"][item.name] = self._remove_item(sender_account, item)
+
+    def equip(self, user, item: Item):
+        with self._edit_account(user) as account:
+            if item.name not in account["stash"]:
+                raise ItemNotFound()
+            account["equipment"][item.get_type()] = item
 
     def wipe_inventories(self, server):
-        self.accounts[server.id] = {}
-        self._save_inventory()
+        self.storage.wipe("inventory", server.id)
 
     def get_server_accounts(self, server):
-        if server.id in self.accounts:
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            accounts = []
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
-            return accounts
-        else:
-            return []
+        return [Account(k, server, v) for k, v in self.storage.get_server("inventory", server.id).items()]
 
     def get_all_accounts(self):
         accounts = []
-        for server_id, v in self.accounts.items():
+        for server_id in self.storage.server_ids("inventory"):
             server = self.bot.get_server(server_id)
             if server is None:
                 # Servers that have since been left will be ignored
                 # Same for users_id from the old bank format
                 continue
-            raw_server_accounts = deepcopy(self.accounts[server.id])
-            for k, v in raw_server_accounts.items():
-                v["id"] = k
-                v["server"] = server
-                acc = self._create_account_obj(v)
-                accounts.append(acc)
+            accounts.extend(self.get_server_accounts(server))
         return accounts
 
     def get_stash(self, user):
-        account = self._get_account(user)
-        return [str(x) for x in account["stash"]]
+        return [str(x) for x in self.get_account(user).stash]
 
     def get_account(self, user):
-        acc = self._get_account(user)
-        acc["id"] = user.id
-        acc["server"] = user.server
-        return self._create_account_obj(acc)
+        return Account(user.id, user.server, self._get_account(user))
 
-    def equip(self, user, item: Item):
-        server = user.server
-        account = self._get_account(user)
-        equipment = account["equipment"]
-        if not self.has_item(user, item):
+    @staticmethod
+    def _remove_item(account, item):
+        """Removes item from the stash and unequips it, returning the stash's copy"""
+        if item.name not in account["stash"]:
             raise ItemNotFound()
-        if isinstance(item, Weapon):
-            equipment["weapon"] = item
-        elif isinstance(item, Armor):
-            equipment["armor"] = item
-        elif isinstance(item, HealPotion):
-            equipment["potion"] = item
-        self.accounts[server.id][user.id] = account
-        self._save_inventory()
-
-    def _create_account_obj(self, account):
-        account["member"] = account["server"].get_member(account["id"])
-        account["created_at"] = datetime.strptime(account["created_at"],
-                                                  "%Y-%m-%d %H:%M:%S")
-        account_obj = Account(**account)
-        return account_obj
-
-    def _save_inventory(self):
-        dataIO.save_json("data/armorsmith/inventory.json", self.accounts)
+        stored = account["stash"].pop(item.name)
+        for slot, equipped in account["equipment"].items():
+            if equipped is not None and equipped[0] == item.name:
+                account["equipment"][slot] = None
+        return stored
+
+    @contextmanager
+    def _edit_account(self, user):
+        """Yields a writable copy of the user's account, stored once the block exits cleanly.
+
+        Only the containers that can change are copied, and shallowly: items
+        are immutable tuples, so they're shared with the stored record."""
+        account = self._copy_account(self._get_account(user))
+        yield account
+        self.storage.put("inventory", user.server.id, user.id, account)
+
+    @staticmethod
+    def _copy_account(stored):
+        account = dict(stored)
+        account["stash"] = OrderedDict(stored["stash"])
+        account["equipment"] = dict(stored["equipment"])
+        return account
 
     def _get_account(self, user):
-        server = user.server
-        try:
-            return deepcopy(self.accounts[server.id][user.id])
-        except KeyError:
+        account = self.storage.get("inventory", user.server.id, user.id)
+        if account is None:
             raise NoAccount()
+        return account
+
+
+class ItemIndex:
+    """Precomputed lookups over a list of items.
+
+    Names are normalized once, so lookups never lower-case per candidate.
+    Exact matches are a dict hit; prefixes are found by bisecting the sorted
+    names; typos are matched through a trigram index."""
+
+    def __init__(self, items):
+        self.by_name = {}
+        self.by_type = defaultdict(dict)
+        self.position = {}
+        self.trigrams = defaultdict(set)
+        for position, item in enumerate(items):
+            key = self.normalize(item.name)
+            self.by_name[key] = item
+            self.by_type[item.get_type()][key] = item
+            self.position[key] = position
+            for trigram in self._trigrams(key):
+                self.trigrams[trigram].add(key)
+        self.sorted_names = sorted(self.by_name)
+
+    @staticmethod
+    def normalize(name):
+        return " ".join(name.lower().split())
+
+    @staticmethod
+    def _trigrams(key):
+        padded = "  {} ".format(key)
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def exact(self, key, item_type=None):
+        names = self.by_name if item_type is None else self.by_type[item_type]
+        return names.get(key)
+
+    def prefixed(self, key, item_type=None):
+        """Items whose name starts with key, in catalog order"""
+        start = bisect_left(self.sorted_names, key)
+        matches = []
+        for name in islice(self.sorted_names, start, None):
+            if not name.startswith(key):
+                break
+            if item_type is None or name in self.by_type[item_type]:
+                matches.append(name)
+        matches.sort(key=self.position.get)
+        return [self.by_name[name] for name in matches]
+
+    def similar(self, key, item_type=None, limit=3, cutoff=FUZZY_CUTOFF):
+        """Items whose names share the most trigrams with key, best first"""
+        trigrams = self._trigrams(key)
+        shared = Counter()
+        for trigram in trigrams:
+            shared.update(self.trigrams.get(trigram, ()))
+        scored = []
+        for name, count in shared.items():
+            if item_type is not None and name not in self.by_type[item_type]:
+                continue
+            score = count / len(trigrams | self._trigrams(name))
+            if score >= cutoff:
+                scored.append((score, name))
+        scored.sort(key=lambda x: (-x[0], self.position[x[1]]))
+        return [self.by_name[name] for _, name in scored[:limit]]
+
+
+class Catalog:
+    """A validated, read-only snapshot of items.json.
+
+    Catalogs are built off the event loop and swapped into Store whole, so a
+    lookup sees either the old item list or the new one, never a mix."""
+
+    SECTIONS = (
+        ("weapons_list", "weapon", Weapon),
+        ("armor_list", "armor", Armor),
+        ("potion_list", "potion", HealPotion)
+    )
+
+    def __init__(self, version, inventory, mtime, parse_time):
+        self.version = version
+        self.inventory = inventory
+        self.mtime = mtime
+        self.parse_time = parse_time
+        self.items = [item for items in inventory.values() for item in items]
+        self.index = ItemIndex(self.items)
+
+    @classmethod
+    def load(cls, file_path, version):
+        """Reads and validates file_path, raising CatalogError if it's unusable"""
+        start = time.perf_counter()
+        try:
+            mtime = os.stat(file_path).st_mtime
+            with open(file_path, encoding="utf-8") as f:
+                item_list = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CatalogError("Could not read {}: {}".format(file_path, e))
+        if not isinstance(item_list, dict):
+            raise CatalogError("The item file must hold an object of item lists")
+        inventory = OrderedDict()
+        seen = set()
+        for section, item_type, item_class in cls.SECTIONS:
+            items = inventory[item_type] = []
+            for entry in item_list.get(section, []):
+                try:
+                    item = item_class(*(entry[field] for field in item_class._fields))
+                except (KeyError, TypeError):
+                    raise CatalogError("{} entry {!r} needs the fields {}".format(
+                        section, entry, ", ".join(item_class._fields)))
+                cls._validate(item)
+                key = ItemIndex.normalize(item.name)
+                if key in seen:
+                    raise CatalogError("Item {} is listed more than once".format(item.name))
+                seen.add(key)
+                items.append(item)
+        return cls(version, inventory, mtime, time.perf_counter() - start)
+
+    @staticmethod
+    def _validate(item):
+        if not isinstance(item.name, str) or not item.name.strip():
+            raise CatalogError("Item {!r} has no name".format(item))
+        if not isinstance(item.cost, int) or item.cost < 0:
+            raise CatalogError("{} has an invalid cost".format(item.name))
+        if isinstance(item, Armor):
+            try:
+                int(item.damage_reduction)
+            except (TypeError, ValueError):
+                raise CatalogError("{} has an invalid damage_reduction".format(item.name))
+        else:
+            dice = item.hit_dice if isinstance(item, Weapon) else item.heal_dice
+            try:
+                # Compiles the expression into Dice.parse's cache ahead of the first fight
+                Dice.parse(dice)
+            except (TypeError, ValueError):
+                raise CatalogError("{} has invalid dice {!r}".format(item.name, dice))
+
+    def diff(self, other):
+        """Names added, removed and changed going from other to this catalog"""
+        old = {item.name: item for item in other.items}
+        new = {item.name: item for item in self.items}
+        added = sorted(new.keys() - old.keys())
+        removed = sorted(old.keys() - new.keys())
+        changed = sorted(name for name in new.keys() & old.keys() if new[name] != old[name])
+        return added, removed, changed
 
 
 class Store:
-    """Interface to item list"""
+    """Interface to item list
+
+    items.json is polled for changes and reloaded in the background. Items
+    dropped from the file are kept as retired, tagged with the last catalog
+    version that sold them, so accounts still holding them can equip, remove
+    and trade them. Retired items can't be bought. The version, the items it
+    sold and the retired items are saved to state_path, so a restart after
+    items.json changed counts as a new version too."""
 
-    def __init__(self, bot, file_path):
+    def __init__(self, bot, file_path, state_path):
         self.bot = bot
         self.file_path = file_path
-        self.inventory = {"weapon": [],
-                          "armor": [],
-                          "potion": []}
-        self._generate_inventory()
-
-    def _generate_inventory(self):
-        item_list = dataIO.load_json(self.file_path)
-        for weapon in item_list["weapons_list"]:
-            self.inventory["weapon"].append(Weapon(
-                weapon["name"],
-                weapon["cost"],
-                weapon["hit_dice"]
-            ))
-        for armor in item_list["armor_list"]:
-            self.inventory["armor"].append(Armor(
-                armor["name"],
-                armor["cost"],
-                armor["damage_reduction"]
-            ))
-        for potion in item_list["potion_list"]:
-            self.inventory["potion"].append(HealPotion(
-                potion["name"],
-                potion["cost"],
-                potion["heal_dice"]
-            ))
-
-    def get_item_by_name(self, item_name):
-        for item_type in self.inventory.values():
-            for item in item_type:
-                if item.name.lower() == item_name.lower():
-                    return item
-        raise ItemNotFound
+        self.state_path = state_path
+        state = dataIO.load_json(state_path) if dataIO.is_valid_json(state_path) else {}
+        self.retired = {key: (version, self._load_item(fields))
+                        for key, (version, fields) in state.get("retired", {}).items()}
+        version = state.get("version", 1)
+        self.catalog = Catalog.load(file_path, version)
+        if "items" in state and state["items"] != [self._dump_item(item) for item in self.catalog.items]:
+            self.catalog.version += 1
+            self._retire([self._load_item(fields) for fields in state["items"]], version)
+        self._save_state()
+        self._rejected_mtime = None
+        self._watcher = self.bot.loop.create_task(self._watch())
+
+    @staticmethod
+    def _load_item(fields):
+        item_class = {item_type: item_class for _, item_type, item_class in Catalog.SECTIONS}[fields[0]]
+        return item_class(*fields[1:])
+
+    @staticmethod
+    def _dump_item(item):
+        return [item.get_type()] + list(item)
+
+    def _save_state(self):
+        dataIO.save_json(self.state_path, {
+            "version": self.catalog.version,
+            "items": [self._dump_item(item) for item in self.catalog.items],
+            "retired": {key: [version, self._dump_item(item)] for key, (version, item) in self.retired.items()}
+        })
+
+    def _retire(self, old_items, old_version):
+        """Marks the items of old_items missing from the current catalog as retired"""
+        names = {ItemIndex.normalize(item.name) for item in self.catalog.items}
+        for item in old_items:
+            key = ItemIndex.normalize(item.name)
+            if key not in names:
+                self.retired[key] = (old_version, item)
+        for key in names:
+            self.retired.pop(key, None)
+
+    @property
+    def inventory(self):
+        return self.catalog.inventory
+
+    @property
+    def index(self):
+        return self.catalog.index
+
+    async def _watch(self):
+        try:
+            while True:
+                await asyncio.sleep(CATALOG_POLL_INTERVAL)
+                try:
+                    mtime = os.stat(self.file_path).st_mtime
+                except OSError:
+                    continue
+                if mtime not in (self.catalog.mtime, self._rejected_mtime):
+                    try:
+                        await self.reload()
+                    except CatalogError as e:
+                        self._rejected_mtime = mtime
+                        logger.warning("Keeping armorsmith catalog v{}: {}".format(self.catalog.version, e))
+        except asyncio.CancelledError:
+            pass
+
+    async def reload(self):
+        """Parses items.json off the event loop and swaps it in.
+
+        Returns the new catalog and its diff against the previous one. Raises
+        CatalogError, leaving the current catalog in place, if the file is invalid."""
+        old = self.catalog
+        new = await self.bot.loop.run_in_executor(None, Catalog.load, self.file_path, old.version + 1)
+        self.catalog = new
+        self._retire(old.items, old.version)
+        self._save_state()
+        return new, new.diff(old)
+
+    def close(self):
+        self._watcher.cancel()
+
+    def get_item_by_name(self, item_name, item_type=None, for_sale=False, exact=False):
+        """Finds an item by exact name, then, unless exact is set, by a name
+        prefix only one item has.
+
+        Matching ignores case and repeated whitespace. Unless for_sale is set,
+        retired items are also found, by exact name. Otherwise ItemNotFound is
+        raised, suggesting the items with that prefix or the closest spellings."""
+        index = self.catalog.index
+        key = index.normalize(item_name)
+        if not key:
+            raise ItemNotFound()
+        item = index.exact(key, item_type)
+        if item is not None:
+            return item
+        if not for_sale and key in self.retired:
+            item = self.retired[key][1]
+            if item_type is None or item.get_type() == item_type:
+                return item
+        matches = index.prefixed(key, item_type)
+        if len(matches) == 1 and not exact:
+            return matches[0]
+        raise ItemNotFound(match.name for match in matches or index.similar(key, item_type))
+
+    @staticmethod
+    def get_owned_item(account, item_name):
+        """Finds an item in account's stash by exact name, ignoring case and repeated whitespace.
+
+        The item is built from the stash's own copy, so items that no catalog
+        version knows of can still be removed and transferred."""
+        key = ItemIndex.normalize(item_name)
+        if key:
+            for name, fields in account.stash.items():
+                if ItemIndex.normalize(name) == key:
+                    return Item(name, fields[1])
+        raise ItemNotFound(name for name in account.stash if key and ItemIndex.normalize(name).startswith(key))
+
+
+def win_rate(entry):
+    games = entry["wins"] + entry["losses"]
+    return entry["wins"] / games if games else 0.0
+
+
+# Leaderboard orderings. Each maps an entry to a sort key, smallest first.
+RANK_MODES = OrderedDict([
+    ("wins", lambda entry: (-entry["wins"], entry["losses"])),
+    ("winrate", lambda entry: (-win_rate(entry), -entry["wins"])),
+    ("elo", lambda entry: (-entry.get("elo", ELO_START), -entry["wins"]))
+])
+
+
+class RankIndex:
+    """One server's leaderboard entries, kept sorted under every ranking mode.
+
+    Each mode keeps a sorted list of (sort key..., user id) tuples; the user
+    id makes every key unique, so an entry's old key can be found again by
+    bisection when it changes. Rank lookups are a bisection, and the top N
+    is a slice."""
+
+    def __init__(self, entries):
+        self.entries = dict(entries)
+        self.keys = {}
+        for mode, sort_key in RANK_MODES.items():
+            self.keys[mode] = sorted(sort_key(entry) + (user_id,) for user_id, entry in self.entries.items())
+
+    def update(self, user_id, entry):
+        old = self.entries.get(user_id)
+        for mode, sort_key in RANK_MODES.items():
+            keys = self.keys[mode]
+            if old is not None:
+                del keys[bisect_left(keys, sort_key(old) + (user_id,))]
+            insort(keys, sort_key(entry) + (user_id,))
+        self.entries[user_id] = entry
+
+    def remove(self, user_id):
+        entry = self.entries.pop(user_id, None)
+        if entry is not None:
+            for mode, sort_key in RANK_MODES.items():
+                keys = self.keys[mode]
+                del keys[bisect_left(keys, sort_key(entry) + (user_id,))]
+
+    def ranked(self, mode):
+        """Yields (user id, entry) pairs, best first"""
+        for key in self.keys[mode]:
+            yield key[-1], self.entries[key[-1]]
+
+    def rank(self, mode, user_id):
+        """1-based position of user_id under mode"""
+        key = RANK_MODES[mode](self.entries[user_id]) + (user_id,)
+        return bisect_left(self.keys[mode], key) + 1
+
+    def __len__(self):
+        return len(self.entries)
 
 
 class Arena:
-    def __init__(self, bot, file_path):
+    def __init__(self, bot, storage):
         self.bot = bot
-        self.leaderboard = dataIO.load_json(file_path)
+        self.storage = storage
+        self.ranks = {}
 
     def create_entry(self, user):
-        server = user.server
         if not self.score_exists(user):
-            if server.id not in self.leaderboard:
-                self.leaderboard[server.id] = {}
-            if user.id in self.leaderboard:
-                wins = self.leaderboard[user.id]["wins"]
-                losses = self.leaderboard[user.id]["losses"]
+            legacy = self.storage.get_legacy("leaderboard", user.id)
+            if legacy is not None:
+                wins = legacy["wins"]
+                losses = legacy["losses"]
             else:
                 wins = 0
                 losses = 0
@@ -343,77 +1484,176 @@ class Arena:
                 "name": user.name,
                 "wins": wins,
                 "losses": losses,
+                "elo": ELO_START,
                 "created_at": timestamp
             }
-            self.leaderboard[server.id][user.id] = entry
-            self._save_leaderboard()
+            self._put_entry(user, entry)
         else:
             raise AccountAlreadyExists()
 
     def score_exists(self, user):
-        try:
-            self._get_entry(user)
-        except NoAccount:
-            return False
-        return True
+        return self.storage.get("leaderboard", user.server.id, user.id) is not None
 
     def get_entry(self, user):
-        score = self._get_entry(user)
-        score["id"] = user.id
-        score["server"] = user.server
-        return self._create_entry_obj(score)
+        return Score(user.id, user.server, self._get_entry(user))
 
     def get_entries(self, server):
-        if server.id in self.leaderboard:
-            raw_server_scores = deepcopy(self.leaderboard[server.id])
-            scores = []
-            for k, v in raw_server_scores.items():
-                v["id"] = k
-                v["server"] = server
-                score = self._create_entry_obj(v)
-                scores.append(score)
-            return scores
-        else:
-            return []
+        return [Score(k, server, v) for k, v in self.storage.get_server("leaderboard", server.id).items()]
 
-    def add_result(self, user, is_win):
-        server = user.server
-        entry = self._get_entry(user)
-        if is_win:
-            entry["wins"] += 1
-        else:
-            entry["losses"] += 1
-        self.leaderboard[server.id][user.id] = entry
-        self._save_leaderboard()
-
-    def _create_entry_obj(self, score):
-        score["member"] = score["server"].get_member(score["id"])
-        score["created_at"] = datetime.strptime(score["created_at"], "%Y-%m-%d %H:%M:%S")
-        Score = namedtuple("Score", "id name wins losses created_at server member")
-        return Score(**score)
+    def get_ranked(self, server, mode="wins"):
+        """Yields the server's scores in rank order, without building them all up front"""
+        for user_id, entry in self._ranks(server).ranked(mode):
+            yield Score(user_id, server, entry)
 
-    def _save_leaderboard(self):
-        dataIO.save_json("data/armorsmith/leaderboard.json", self.leaderboard)
+    def get_rank(self, user, mode="wins"):
+        """Returns the user's 1-based rank and the number of ranked users"""
+        entry = self._get_entry(user)
+        ranks = self._ranks(user.server)
+        if user.id not in ranks.entries:
+            ranks.update(user.id, entry)
+        return ranks.rank(mode, user.id), len(ranks)
+
+    def member_left(self, member):
+        if member.server.id in self.ranks:
+            self.ranks[member.server.id].remove(member.id)
+
+    def member_joined(self, member):
+        if member.server.id in self.ranks:
+            entry = self.storage.get("leaderboard", member.server.id, member.id)
+            if entry is not None:
+                self.ranks[member.server.id].update(member.id, entry)
+
+    def record_duel(self, winner, loser):
+        """Adds a win and a loss, and moves Elo ratings by how unexpected the result was"""
+        winner_entry = dict(self._get_entry(winner))
+        loser_entry = dict(self._get_entry(loser))
+        winner_elo = winner_entry.get("elo", ELO_START)
+        loser_elo = loser_entry.get("elo", ELO_START)
+        expected = 1 / (1 + 10 ** ((loser_elo - winner_elo) / 400))
+        change = ELO_K * (1 - expected)
+        winner_entry["wins"] += 1
+        winner_entry["elo"] = round(winner_elo + change, 1)
+        loser_entry["losses"] += 1
+        loser_entry["elo"] = round(loser_elo - change, 1)
+        self._put_entry(winner, winner_entry)
+        self._put_entry(loser, loser_entry)
+
+    def _ranks(self, server):
+        """The server's rank index, holding only members still on the server so
+        ranks match the leaderboard"""
+        if server.id not in self.ranks:
+            self.ranks[server.id] = RankIndex(
+                (user_id, entry) for user_id, entry in self.storage.get_server("leaderboard", server.id).items()
+                if server.get_member(user_id) is not None)
+        return self.ranks[server.id]
+
+    def _put_entry(self, user, entry):
+        self.storage.put("leaderboard", user.server.id, user.id, entry)
+        if user.server.id in self.ranks:
+            self.ranks[user.server.id].update(user.id, entry)
 
     def _get_entry(self, user):
-        server = user.server
-        try:
-            return deepcopy(self.leaderboard[server.id][user.id])
-        except KeyError:
+        entry = self.storage.get("leaderboard", user.server.id, user.id)
+        if entry is None:
             raise NoAccount()
+        return entry
+
+
+class Tournament:
+    """Registration and bracket state of one server's tournament.
+
+    Brackets advance a round at a time, and every match of a round is fought
+    at once. In double elimination, players who lose in the winners' bracket
+    drop into the losers' bracket and are out after a second loss. The two
+    brackets' survivors meet in a grand final, which is replayed once if the
+    losers' bracket player wins it."""
+
+    FORMATS = ("single", "double")
+
+    def __init__(self, host, channel, bracket, fee):
+        self.host = host
+        self.channel = channel
+        self.bracket = bracket
+        self.fee = fee
+        self.entrants = OrderedDict()
+        self.paid = []
+        self.settled = False
+        self.winners = []
+        self.losers = []
+        self.round = 0
+        self.started = False
+        self.final_replayed = False
+
+    @property
+    def pot(self):
+        return self.fee * len(self.entrants)
+
+    def start(self):
+        self.started = True
+        self.winners = list(self.entrants.values())
+
+    def next_round(self):
+        """Pairs up the next round's matches as (bracket, first, second) tuples; empty once decided"""
+        matches = []
+        if len(self.winners) > 1:
+            matches.extend(self._pair("winners", self.winners))
+        if len(self.losers) > 1:
+            matches.extend(self._pair("losers", self.losers))
+        if not matches and len(self.winners) == 1 and len(self.losers) == 1:
+            matches.append(("final", self.winners[0], self.losers[0]))
+        return matches
+
+    @staticmethod
+    def _pair(bracket, players):
+        shuffle(players)
+        return [(bracket, players[i], players[i + 1]) for i in range(0, len(players) - 1, 2)]
+
+    def record_round(self, results):
+        """Advances the brackets from a round's (bracket, winner, loser) results"""
+        winners = self.winners[-1:] if len(self.winners) % 2 else []
+        losers = self.losers[-1:] if len(self.losers) % 2 else []
+        for bracket, winner, loser in results:
+            if bracket == "winners":
+                winners.append(winner)
+                if self.bracket == "double":
+                    losers.append(loser)
+            elif bracket == "losers":
+                losers.append(winner)
+            elif winner is self.winners[0] or self.final_replayed:
+                winners, losers = [winner], []
+            else:
+                # Both finalists now have one loss; the final is played again
+                self.final_replayed = True
+                winners, losers = [winner], [loser]
+        self.winners = winners
+        self.losers = losers
+
+    @property
+    def champion(self):
+        return self.winners[0] if len(self.winners) == 1 and not self.losers else None
 
 
 class Armorsmith:
     def __init__(self, bot):
         global DEFAULTS
         self.bot = bot
-        self.inventory = Inventory(bot, "data/armorsmith/inventory.json")
-        self.store = Store(bot, "data/armorsmith/items.json")
-        self.arena = Arena(bot, "data/armorsmith/leaderboard.json")
+        self.storage = BACKENDS[STORAGE_BACKEND](bot, "data/armorsmith")
+        self.inventory = Inventory(bot, self.storage)
+        self.store = Store(bot, "data/armorsmith/items.json", "data/armorsmith/catalog.json")
+        self.arena = Arena(bot, self.storage)
         self.bank = self.bot.get_cog("Economy").bank
-        self.file_path = "data/armorsmith/settings.json"
-        self.settings = dataIO.load_json(self.file_path)
-        self.settings = defaultdict(lambda: DEFAULTS, self.settings)
+        self.settings = defaultdict(lambda: DEFAULTS, self.storage.load_settings())
+        self.tournaments = {}
+
+    def __unload(self):
+        self.store.close()
+        self.storage.close()
+
+    async def on_member_remove(self, member):
+        self.arena.member_left(member)
+
+    async def on_member_join(self, member):
+        self.arena.member_joined(member)
 
     @commands.group(name="inventory", pass_context=True)
     async def _inventory(self, ctx):
@@ -453,15 +1693,15 @@ class Armorsmith:
         """Transfers an item to other users."""
         author = ctx.message.author
         try:
-            item = self.store.get_item_by_name(item)
+            item = self.store.get_owned_item(self.inventory.get_account(author), item)
             self.inventory.transfer_item(author, user, item)
             logger.info(
                 "{} ({}) transferred {} to {}({})".format(author.name, author.id, item.name, user.name, user.id))
             await self.bot.say("{} has been transferred to {}'s stash.".format(item.name, user.name))
         except SameSenderAndReceiver:
             await self.bot.say("You can't transfer to yourself.")
-        except ItemNotFound:
-            await self.bot.say("Item was not found in your stash.")
+        except ItemNotFound as e:
+            await self.bot.say(e.did_you_mean("Item was not found in your stash."))
         except NoAccount:
             await self.bot.say("That user has no stash account.")
 
@@ -472,9 +1712,9 @@ class Armorsmith:
         try:
             item = self.store.get_item_by_name(item_name)
             self.inventory.equip(author, item)
-            await self.bot.say("{} equipped {}".format(author.mention, item_name))
-        except ItemNotFound:
-            await self.bot.say("Item name was not found.")
+            await self.bot.say("{} equipped {}".format(author.mention, item.name))
+        except ItemNotFound as e:
+            await self.bot.say(e.did_you_mean("Item name was not found."))
         except NoAccount:
             await self.bot.say("Please register an account with the inventory before equipping.")
 
@@ -496,11 +1736,13 @@ class Armorsmith:
         """Removes an item from your inventory (and unequips it)"""
         user = ctx.message.author
         try:
-            item = self.store.get_item_by_name(item_name)
+            item = self.store.get_owned_item(self.inventory.get_account(user), item_name)
             self.inventory.remove_item(user, item)
-            await self.bot.say("Removed item {} fom inventory".format(item_name))
-        except ItemNotFound:
-            await self.bot.say("Item was not found.")
+            await self.bot.say("Removed item {} fom inventory".format(item.name))
+        except ItemNotFound as e:
+            await self.bot.say(e.did_you_mean("Item was not found in your stash."))
+        except NoAccount:
+            await self.bot.say("You don't have a stash with the Armorsmith.")
 
     @_inventory.command(name="give", pass_context=True)
     @checks.admin_or_permissions(manage_server=True)
@@ -508,12 +1750,12 @@ class Armorsmith:
         """Gives an item to a user."""
         author = ctx.message.author
         try:
-            item_obj = self.store.get_item_by_name(item_name)
+            item_obj = self.store.get_item_by_name(item_name, exact=True)
             self.inventory.give_item(user, item_obj)
             logger.info("{}({}) gave {} to {}({})".format(author.name, author.id, item_obj.name, user.name, user.id))
             await self.bot.say("{} has been given to {}".format(item_obj.name, user.name))
-        except ItemNotFound:
-            await self.bot.say("Item name does not exist")
+        except ItemNotFound as e:
+            await self.bot.say(e.did_you_mean("Item name does not exist."))
 
     @_inventory.command(pass_context=True, no_pm=True)
     @checks.serverowner_or_permissions(administrator=True)
@@ -546,22 +1788,39 @@ class Armorsmith:
         for page in pagify(message, shorten_by=12):
             await self.bot.whisper(box(page))
 
+    @_store.command(name="reload", pass_context=True)
+    @checks.admin_or_permissions(manage_server=True)
+    async def _reload(self, ctx):
+        """Reloads the item list from items.json"""
+        try:
+            catalog, (added, removed, changed) = await self.store.reload()
+        except CatalogError as e:
+            await self.bot.say("The item file was not loaded: {}".format(e))
+            return
+        msg = "Loaded catalog v{} in {:.1f} ms: {} items.\n".format(
+            catalog.version, catalog.parse_time * 1000, len(catalog.items))
+        msg += "Added: {}\n".format(", ".join(added) or "none")
+        msg += "Removed: {}\n".format(", ".join(removed) or "none")
+        msg += "Changed: {}".format(", ".join(changed) or "none")
+        for page in pagify(msg):
+            await self.bot.say(page)
+
     @_store.command(pass_context=True, no_pm=True)
     async def buy(self, ctx, *, item_name):
         """Buy an item for yourself"""
         author = ctx.message.author
         try:
-            item = self.store.get_item_by_name(item_name)
+            item = self.store.get_item_by_name(item_name, for_sale=True, exact=True)
             if not self.bank.can_spend(author, item.cost):
                 await self.bot.say("You have insufficient funds to purchase that item.")
                 return
             self.bank.withdraw_credits(author, item.cost)
             self.inventory.give_item(author, item)
-            await self.bot.say("{} bought {} for {} credits.".format(author.mention, item_name, item.cost))
+            await self.bot.say("{} bought {} for {} credits.".format(author.mention, item.name, item.cost))
         except NoAccount:
             await self.bot.say("You do not have a stash register. Please do so before buying.")
-        except ItemNotFound:
-            await self.bot.say("The item specified does not exist.")
+        except ItemNotFound as e:
+            await self.bot.say(e.did_you_mean("The item specified does not exist."))
 
     @commands.group(name="fight", pass_context=True)
     async def _fight(self, ctx):
@@ -603,10 +1862,11 @@ class Armorsmith:
         if msg and msg.content == "yes":
             result = await self.duel(author, user, settings)
             if result != None:
-                battle_text, author_won = result
-                for page in pagify(battle_text, shorten_by=12):
-                    await self.bot.say(box(page, lang="py"))
-                if author_won:
+                result, seed = result
+                renderer = BATTLE_RENDERERS[settings.get("BATTLE_LOG", DEFAULTS["BATTLE_LOG"])](self.bot)
+                await renderer.render(ctx.message.channel, (author.name, user.name), settings.get("HP", 50),
+                                      result, seed)
+                if result.author_won:
                     self.bank.transfer_credits(user, author, wager)
                 else:
                     self.bank.transfer_credits(author, user, wager)
@@ -617,70 +1877,264 @@ class Armorsmith:
 
     async def duel(self, author, user, settings):
         """Fight between two people"""
-        hp_author = settings.get("HP", 50)
-        hp_user = settings.get("HP", 50)
         a_weapon, a_armor, a_potion = self.inventory.get_account(author).get_equipment()
         u_weapon, u_armor, u_potion = self.inventory.get_account(user).get_equipment()
         if not a_weapon or not u_weapon:
             await self.bot.say("One or more players does not have a weapon equipped!".format(user.mention))
             return
-        battle_text = ""
-        while hp_author > 0 and hp_user > 0:
-            damage_to_user = a_weapon.damage_roll()
-            if u_armor:
-                damage_to_user = u_armor.block_damage(damage_to_user)
-            hp_user -= damage_to_user
-            battle_text += "{} hit {} for {} damage!\n".format(author.name, user.name, damage_to_user)
-            if hp_user <= 0 and u_potion is not None:
-                hp_user += u_potion.healing_roll()
-                self.inventory.remove_item(user, u_potion)
-                u_potion = None
-                battle_text += "{} used a potion\n".format(user.name)
-            damage_to_author = u_weapon.damage_roll()
-            if a_armor:
-                damage_to_author = a_armor.block_damage(damage_to_author)
-            hp_author -= damage_to_author
-            battle_text += "{} hit {} for {} damage\n".format(user.name, author.name, damage_to_author)
-            if hp_author <= 0 and a_potion is not None:
-                hp_author += a_potion.healing_roll()
-                self.inventory.remove_item(author, a_potion)
-                a_potion = None
-                battle_text += "{} used a potion".format(author.name)
-        if hp_user <= 0:
-            battle_text += "{} beat {} in a duel with {} hp remaining!\n".format(author.name, user.name, hp_author)
-            self.arena.add_result(author, True)
-            self.arena.add_result(user, False)
-            author_won = True
+        # Every duel gets its own seed, so any fight can be replayed exactly with run_duel
+        seed = getrandbits(63)
+        result = run_duel(Loadout.from_equipment(a_weapon, a_armor, a_potion),
+                          Loadout.from_equipment(u_weapon, u_armor, u_potion),
+                          settings.get("HP", 50), np.random.default_rng(seed))
+        logger.info("{}({}) dueled {}({}) with seed {}".format(author.name, author.id, user.name, user.id, seed))
+        if result.potions_used[0]:
+            self.inventory.remove_item(author, a_potion)
+        if result.potions_used[1]:
+            self.inventory.remove_item(user, u_potion)
+        if result.author_won:
+            self.arena.record_duel(author, user)
         else:
-            battle_text += "{} beat {} in a duel with {} hp remaining!\n".format(user.name, author.name, hp_user)
-            self.arena.add_result(user, True)
-            self.arena.add_result(author, False)
-            author_won = False
-        return battle_text, author_won
+            self.arena.record_duel(user, author)
+        return result, seed
 
     @_fight.command(pass_context=True, no_pm=True)
-    async def leaderboard(self, ctx, top=10):
-        """Displays the win/loss leaderboard"""
+    async def odds(self, ctx, user: discord.Member):
+        """Estimates your chance of beating a user, from simulated duels"""
+        author = ctx.message.author
+        try:
+            a_equipment = self.inventory.get_account(author).get_equipment()
+            u_equipment = self.inventory.get_account(user).get_equipment()
+        except NoAccount:
+            await self.bot.say("Both fighters need a stash account.")
+            return
+        if not a_equipment[0] or not u_equipment[0]:
+            await self.bot.say("One or more players does not have a weapon equipped!")
+            return
+        hp = self.settings[ctx.message.server.id].get("HP", 50)
+        start = time.perf_counter()
+        wins = await self.bot.loop.run_in_executor(
+            None, lambda: simulate_duels(Loadout.from_equipment(*a_equipment), Loadout.from_equipment(*u_equipment),
+                                         hp, ODDS_SIMULATIONS, np.random.default_rng()))
+        elapsed = time.perf_counter() - start
+        await self.bot.say("{} wins {:.1%} of {:,} simulated duels against {} ({:.0f} ms).".format(
+            author.name, wins.mean(), ODDS_SIMULATIONS, user.name, elapsed * 1000))
+
+    @_fight.group(name="tournament", pass_context=True, no_pm=True)
+    async def _tournament(self, ctx):
+        """Bracket tournaments."""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+
+    @_tournament.command(name="open", pass_context=True, no_pm=True)
+    async def tournament_open(self, ctx, bracket="single", fee: int = 0):
+        """Opens registration for a single or double elimination tournament, with an optional entry fee"""
+        server = ctx.message.server
+        bracket = bracket.lower()
+        if server.id in self.tournaments:
+            await self.bot.say("A tournament is already running on this server.")
+            return
+        if bracket not in Tournament.FORMATS:
+            await self.bot.say("The bracket must be one of: {}".format(", ".join(Tournament.FORMATS)))
+            return
+        if fee < 0:
+            await self.bot.say("The entry fee can't be negative.")
+            return
+        self.tournaments[server.id] = Tournament(ctx.message.author, ctx.message.channel, bracket, fee)
+        await self.bot.say("A {} elimination tournament is open{}! Type `{}fight tournament join` to enter.".format(
+            bracket, " with a {} credit entry fee".format(fee) if fee else "", ctx.prefix))
+
+    @_tournament.command(name="join", pass_context=True, no_pm=True)
+    async def tournament_join(self, ctx):
+        """Enters the open tournament"""
+        author = ctx.message.author
+        tournament = self.tournaments.get(author.server.id)
+        if tournament is None or tournament.started:
+            await self.bot.say("There's no tournament taking entries.")
+            return
+        try:
+            weapon = self.inventory.get_account(author).get_equipment()[0]
+        except NoAccount:
+            await self.bot.say("You must have an account to fight. Make one with `{}inventory register`".format(
+                ctx.prefix))
+            return
+        if not weapon:
+            await self.bot.say("Equip a weapon before entering.")
+            return
+        if tournament.fee and not self.bank.can_spend(author, tournament.fee):
+            await self.bot.say("You can't afford the entry fee.")
+            return
+        tournament.entrants[author.id] = author
+        await self.bot.say("{} entered the tournament ({} entrants).".format(author.mention, len(tournament.entrants)))
+
+    @_tournament.command(name="leave", pass_context=True, no_pm=True)
+    async def tournament_leave(self, ctx):
+        """Withdraws from the tournament before it starts"""
+        author = ctx.message.author
+        tournament = self.tournaments.get(author.server.id)
+        if tournament is None or tournament.started or tournament.entrants.pop(author.id, None) is None:
+            await self.bot.say("You're not registered for an upcoming tournament.")
+            return
+        await self.bot.say("{} left the tournament.".format(author.mention))
+
+    @_tournament.command(name="cancel", pass_context=True, no_pm=True)
+    async def tournament_cancel(self, ctx):
+        """Cancels the tournament before it starts"""
+        tournament = self.tournaments.get(ctx.message.server.id)
+        if tournament is None or tournament.started:
+            await self.bot.say("There's no tournament to cancel.")
+            return
+        if not self._can_run(ctx.message.author, tournament):
+            await self.bot.say("Only the host or a server manager can do that.")
+            return
+        del self.tournaments[ctx.message.server.id]
+        await self.bot.say("Tournament cancelled.")
+
+    @_tournament.command(name="start", pass_context=True, no_pm=True)
+    async def tournament_start(self, ctx):
+        """Closes registration and fights the tournament out"""
+        server = ctx.message.server
+        tournament = self.tournaments.get(server.id)
+        if tournament is None or tournament.started:
+            await self.bot.say("There's no tournament waiting to start.")
+            return
+        if not self._can_run(ctx.message.author, tournament):
+            await self.bot.say("Only the host or a server manager can do that.")
+            return
+        if tournament.fee:
+            for member in list(tournament.entrants.values()):
+                if not self.bank.can_spend(member, tournament.fee):
+                    del tournament.entrants[member.id]
+                    await self.bot.say("{} can no longer afford the entry fee and was removed.".format(member.name))
+        if len(tournament.entrants) < 2:
+            await self.bot.say("At least two entrants are needed to start.")
+            return
+        tournament.start()
+        try:
+            for member in tournament.entrants.values():
+                if tournament.fee:
+                    self.bank.withdraw_credits(member, tournament.fee)
+                    tournament.paid.append(member)
+                try:
+                    self.arena.create_entry(member)
+                except AccountAlreadyExists:
+                    pass
+            await self._run_tournament(tournament, self.settings[server.id])
+        finally:
+            del self.tournaments[server.id]
+            if not tournament.settled:
+                # The tournament was aborted before the pot was paid out
+                for member in tournament.paid:
+                    self.bank.deposit_credits(member, tournament.fee)
+                logger.info("Refunded {} entry fees of an aborted tournament on {}".format(
+                    len(tournament.paid), server.id))
+
+    @staticmethod
+    def _can_run(member, tournament):
+        return member == tournament.host or member.server_permissions.manage_server
+
+    async def _run_tournament(self, tournament, settings):
+        hp = settings.get("HP", 50)
+        equipment = {member.id: self.inventory.get_account(member).get_equipment()
+                     for member in tournament.entrants.values()}
+        loadouts = {member_id: Loadout.from_equipment(*items) for member_id, items in equipment.items()}
+        await self.bot.say("The tournament begins with {} fighters!".format(len(tournament.entrants)))
+        while True:
+            matches = tournament.next_round()
+            if not matches:
+                break
+            tournament.round += 1
+            # The round's duels are independent, so they're all fought at once off the event loop
+            outcomes = await asyncio.gather(*(
+                self.bot.loop.run_in_executor(None, run_duel, loadouts[first.id], loadouts[second.id], hp,
+                                              np.random.default_rng(getrandbits(63)))
+                for _, first, second in matches))
+            results = []
+            summary = "Round {}\n".format(tournament.round)
+            # One flush for the whole round's results and spent potions
+            with self.storage.batch():
+                for (bracket, first, second), outcome in zip(matches, outcomes):
+                    for member, used in zip((first, second), outcome.potions_used):
+                        if used:
+                            # The entrant may have removed or traded the potion since the tournament started
+                            self.inventory.discard_item(member, equipment[member.id][2])
+                            loadouts[member.id] = loadouts[member.id]._replace(potion=None)
+                    if outcome.author_won:
+                        winner, loser, hp_left = first, second, outcome.hp_author
+                    else:
+                        winner, loser, hp_left = second, first, outcome.hp_user
+                    self.arena.record_duel(winner, loser)
+                    results.append((bracket, winner, loser))
+                    summary += "[{}] {} beat {} with {} hp remaining\n".format(
+                        bracket, winner.display_name, loser.display_name, hp_left)
+            tournament.record_round(results)
+            for page in pagify(summary, shorten_by=12):
+                await self.bot.say(box(page, lang="py"))
+        champion = tournament.champion
+        msg = "{} is the tournament champion!".format(champion.mention)
+        if tournament.pot:
+            self.bank.deposit_credits(champion, tournament.pot)
+            msg += " They take the {} credit pot.".format(tournament.pot)
+        tournament.settled = True
+        await self.bot.say(msg)
+
+    @_fight.command(pass_context=True, no_pm=True)
+    async def leaderboard(self, ctx, top="10", mode="wins"):
+        """Displays the leaderboard
+
+        Rank by wins, winrate or elo, e.g. `leaderboard elo` or `leaderboard 20 elo`."""
         server = ctx.message.server
+        if not top.isdigit():
+            top, mode = mode if mode.isdigit() else "10", top
+        top = int(top)
+        mode = mode.lower()
+        if mode not in RANK_MODES:
+            await self.bot.say("Rank by one of: {}".format(", ".join(RANK_MODES)))
+            return
         if top < 1:
             top = 10
-        entries_sorted = sorted(self.arena.get_entries(server), key=lambda x: x.wins, reverse=True)
-        entries_sorted = [a for a in entries_sorted if a.member]
-        if len(entries_sorted) < top:
-            top = len(entries_sorted)
-        topentries = entries_sorted[:top]
-        highscore = "Wins Losses\n".rjust(23)
+        topentries = []
+        for acc in self.arena.get_ranked(server, mode):
+            if acc.member:
+                topentries.append(acc)
+                if len(topentries) == top:
+                    break
+        if not topentries:
+            await self.bot.say("There are no accounts in the leaderboard")
+            return
+        top = len(topentries)
+        highscore = "Wins Losses\n".rjust(23) if mode == "wins" else "Wins Losses {}\n".format(mode.title()).rjust(30)
         place = 1
         for acc in topentries:
             highscore += str(place).ljust(len(str(top)) + 1)
             highscore += (str(acc.member.display_name) + " ").ljust(23 - len(str(acc.wins) + " " + str(acc.losses)))
-            highscore += str(acc.wins) + " " + str(acc.losses) + "\n"
+            highscore += str(acc.wins) + " " + str(acc.losses)
+            if mode == "winrate":
+                highscore += " {:.0%}".format(acc.win_rate)
+            elif mode == "elo":
+                highscore += " {:.0f}".format(acc.elo)
+            highscore += "\n"
             place += 1
-        if highscore != "":
-            for page in pagify(highscore, shorten_by=12):
-                await self.bot.say(box(page, lang="py"))
-        else:
-            await self.bot.say("There are no accounts in the leaderboard")
+        for page in pagify(highscore, shorten_by=12):
+            await self.bot.say(box(page, lang="py"))
+
+    @_fight.command(pass_context=True, no_pm=True)
+    async def rank(self, ctx, user: discord.Member = None, mode="wins"):
+        """Shows where a user places on the leaderboard. Defaults to you."""
+        if not user:
+            user = ctx.message.author
+        mode = mode.lower()
+        if mode not in RANK_MODES:
+            await self.bot.say("Rank by one of: {}".format(", ".join(RANK_MODES)))
+            return
+        try:
+            place, total = self.arena.get_rank(user, mode)
+        except NoAccount:
+            await self.bot.say("{} hasn't fought in the arena yet.".format(user.name))
+            return
+        score = self.arena.get_entry(user)
+        await self.bot.say("{} is ranked #{} of {} by {} ({} wins, {} losses, {:.0%} win rate, {:.0f} Elo).".format(
+            user.name, place, total, mode, score.wins, score.losses, score.win_rate, score.elo))
 
     @commands.group(name="armorsmithset", pass_context=True, no_pm=True)
     @checks.admin_or_permissions(manage_server=True)
@@ -696,6 +2150,20 @@ class Armorsmith:
             await send_cmd_help(ctx)
             await self.bot.say(msg)
 
+    @armorsmithset.command(name="battlelog", pass_context=True)
+    async def _battlelog(self, ctx, mode: str):
+        """How duels are reported: summary, file or live"""
+        server = ctx.message.server
+        mode = mode.lower()
+        if mode not in BATTLE_RENDERERS:
+            await self.bot.say("The battle log must be one of: {}".format(", ".join(BATTLE_RENDERERS)))
+            return
+        settings = dict(self.settings[server.id])
+        settings["BATTLE_LOG"] = mode
+        self.settings[server.id] = settings
+        self.storage.put_settings(server.id, settings)
+        await self.bot.say("Duels will now be reported as: {}".format(mode))
+
 
 def check_folders():
     if not os.path.exists("data/armorsmith"):
@@ -0,0 +1,116 @@
+"""Armorsmith hot paths, timed against what they replaced.
+
+    PYTHONPATH=path/to/Red-DiscordBot python benchmarks/armorsmith.py accounts [iterations]
+    PYTHONPATH=path/to/Red-DiscordBot python benchmarks/armorsmith.py dice [rolls] [expression]
+
+accounts: peak bytes allocated and time per account read, from deep copies
+          to read-only views, for an account holding every shipped item
+dice:     time per roll of the old string-parsing roll against compiled dice
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from copy import deepcopy
+from datetime import datetime
+from random import choice
+
+import numpy as np
+
+from loader import ROOT, load_cog
+
+armorsmith = load_cog("armorsmith")
+
+ITEMS_PATH = os.path.join(ROOT, "armorsmith", "data", "items.json")
+
+LEGACY_DICE_PATTERN = re.compile(r"^\d+d\d+$")
+
+
+def legacy_account_read(stored):
+    """The account read path before read-only views: a deep copy and a parsed timestamp per read"""
+    account = deepcopy(stored)
+    datetime.strptime(account["created_at"], "%Y-%m-%d %H:%M:%S")
+    return armorsmith.Account(None, None, account)
+
+
+def legacy_roll_dice(dice):
+    """Item._roll_dice as it was before dice were compiled"""
+    (num_rolls, dice_sides) = map(int, dice.split('d'))
+    val = 0
+    for roll in range(num_rolls):
+        val += choice(range(1, dice_sides + 1))
+    return val
+
+
+def measure_allocations(func, iterations):
+    """Returns the mean peak bytes allocated by one call of func, and its mean run time"""
+    peak_total = 0
+    for _ in range(iterations):
+        tracemalloc.start()
+        func()
+        peak_total += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return peak_total / iterations, (time.perf_counter() - start) / iterations
+
+
+def stored_account():
+    """An account record as storage holds it, with every shipped item in the stash"""
+    catalog = armorsmith.Catalog.load(ITEMS_PATH, 1)
+    return {"name": "benchmark",
+            "stash": OrderedDict((item.name, list(item)) for item in catalog.items),
+            "created_at": "2017-01-01 00:00:00",
+            "equipment": {kind: list(items[0]) for kind, items in catalog.inventory.items()}}
+
+
+def accounts(iterations=1000):
+    stored = stored_account()
+    # Before: every read deep-copied the record. A transfer read the sender's
+    # account six times and the receiver's once.
+    cases = [
+        ("equipment (before)", lambda: legacy_account_read(stored).get_equipment()),
+        ("equipment (after)", lambda: armorsmith.Account(None, None, stored).get_equipment()),
+        ("transfer (before)", lambda: [legacy_account_read(stored) for _ in range(7)]),
+        ("transfer (after)", lambda: [armorsmith.Inventory._copy_account(stored) for _ in range(2)])
+    ]
+    print("{:<20}{:>12}{:>12}".format("Command", "Peak bytes", "Time (us)"))
+    for name, func in cases:
+        peak, elapsed = measure_allocations(func, int(iterations))
+        print("{:<20}{:>12.0f}{:>12.1f}".format(name, peak, elapsed * 1e6))
+
+
+def dice(rolls=10000, expression="1d8"):
+    rolls = int(rolls)
+    compiled = armorsmith.Dice.parse(expression)
+    rng = np.random.default_rng(0)
+    cases = [("compiled, one roll", lambda: [compiled.roll() for _ in range(rolls)]),
+             ("compiled, batched", lambda: compiled.roll_many(rng, rolls))]
+    if LEGACY_DICE_PATTERN.match(expression):
+        cases.insert(0, ("legacy _roll_dice", lambda: [legacy_roll_dice(expression) for _ in range(rolls)]))
+    print("{} x {}".format(rolls, compiled))
+    print("{:<22}{:>12}".format("Path", "ns per roll"))
+    for name, func in cases:
+        start = time.perf_counter()
+        func()
+        print("{:<22}{:>12.0f}".format(name, (time.perf_counter() - start) / rolls * 1e9))
+
+
+BENCHMARKS = OrderedDict([
+    ("accounts", accounts),
+    ("dice", dice)
+])
+
+
+def main(name=None, *args):
+    if name not in BENCHMARKS:
+        print("Benchmarks: {}".format(", ".join(BENCHMARKS)))
+        return
+    BENCHMARKS[name](*args)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
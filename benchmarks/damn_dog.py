@@ -0,0 +1,127 @@
+"""Wakeups, CPU and memory of concurrent DamnSession.wait_for_answer rounds.
+
+Runs SESSIONS games against a stub bot, each waiting out one round of
+SECONDS. Halfway through, every other session gets its correct answer
+through check_answer; the rest wait for the DELAY deadline.
+
+    PYTHONPATH=path/to/Red-DiscordBot python benchmarks/damn_dog.py [sessions] [seconds]
+"""
+import asyncio
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from loader import load_cog
+
+damn_dog = load_cog("damn-dog")
+
+
+class Server:
+    def __init__(self, id):
+        self.id = id
+        self.name = "server {}".format(id)
+
+
+class Channel:
+    def __init__(self, id):
+        self.id = id
+        self.name = "channel {}".format(id)
+        self.server = Server(id)
+
+
+class User:
+    def __init__(self, id):
+        self.id = id
+        self.name = "user {}".format(id)
+
+
+class Message:
+    def __init__(self, channel, author, content=""):
+        self.id = channel.id
+        self.channel = channel
+        self.server = channel.server
+        self.author = author
+        self.content = content
+        self.timestamp = time.time()
+
+
+class Bot:
+    def __init__(self, loop):
+        self.loop = loop
+        self.user = User(0)
+
+    async def send_message(self, channel, content=None, **kwargs):
+        pass
+
+    async def send_typing(self, channel):
+        pass
+
+    def dispatch(self, event, *args):
+        pass
+
+
+class CountingEvent(asyncio.Event):
+    """A round_over event counting each pass of the wait loop, which checks it once per wakeup"""
+
+    def __init__(self, wakeups):
+        super().__init__()
+        self.wakeups = wakeups
+
+    def is_set(self):
+        self.wakeups["wakeups"] += 1
+        return super().is_set()
+
+
+def start_round(bot, metrics, wakeups, number, seconds):
+    channel = Channel(number)
+    questions = damn_dog.Questions(["Dog"], ["dog.png"], [[]])
+    settings = dict(damn_dog.DEFAULTS, DELAY=seconds)
+    session = damn_dog.DamnSession(bot, questions, None, None, metrics, Message(channel, User(number)), settings)
+    session.round_over = CountingEvent(wakeups)
+    session.correct_answer = "Dog"
+    session.answer_dict = {"dog": "1"}
+    session.status = "waiting for answer"
+    session.timer = session.asked = time.perf_counter()
+    return session
+
+
+async def answer(session, waiting, latencies):
+    """Answers the round and times how long until its wait returns"""
+    start = time.perf_counter()
+    await session.check_answer(Message(session.channel, User(-session.channel.id), "1"))
+    await waiting
+    latencies.append(time.perf_counter() - start)
+
+
+async def benchmark(loop, sessions, seconds):
+    bot = Bot(loop)
+    metrics = damn_dog.RoundMetrics()
+    wakeups = Counter()
+    latencies = []
+    tracemalloc.start()
+    cpu = time.process_time()
+    rounds = [start_round(bot, metrics, wakeups, number, seconds) for number in range(1, sessions + 1)]
+    waiting = [loop.create_task(session.wait_for_answer()) for session in rounds]
+    await asyncio.sleep(seconds / 2)
+    await asyncio.gather(*(answer(session, wait, latencies) for session, wait in zip(rounds[::2], waiting[::2])))
+    await asyncio.gather(*waiting)
+    cpu = time.process_time() - cpu
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    latencies.sort()
+    print("{} sessions, {} second rounds, half answered midway".format(sessions, seconds))
+    print("Wakeups:         {} ({:.2f} per round)".format(wakeups["wakeups"], wakeups["wakeups"] / sessions))
+    print("CPU:             {:.1f} ms".format(cpu * 1000))
+    print("Peak memory:     {:.1f} KiB".format(peak / 1024))
+    print("Answer to wake:  p50 {:.2f} ms, max {:.2f} ms".format(
+        damn_dog.percentile(latencies, 50) * 1000, latencies[-1] * 1000))
+
+
+def main(sessions=500, seconds=10):
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(benchmark(loop, sessions, seconds))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,64 @@
+"""Event loop lag while TtsCache synthesizes a burst of join announcements.
+
+Requests JOINS distinct clips at once, spread over SERVERS servers, from a
+stub engine taking LATENCY seconds per clip, and measures how late a 10 ms
+heartbeat on the event loop wakes up meanwhile.
+
+    PYTHONPATH=path/to/Red-DiscordBot python benchmarks/on_join_tts.py [joins] [servers] [latency]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+
+from loader import load_cog
+
+on_join = load_cog("on_join")
+
+
+class StubBackend:
+    """Writes an empty clip after a fixed delay, standing in for a real engine"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def synthesize(self, text, locale, path):
+        time.sleep(self.latency)
+        open(path, "wb").close()
+
+
+async def benchmark(loop, path, joins, servers, latency):
+    cache = on_join.TtsCache(loop, StubBackend(latency), path=path)
+    lag = []
+
+    async def heartbeat():
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag.append(time.perf_counter() - start - 0.01)
+
+    beat = loop.create_task(heartbeat())
+    start = time.perf_counter()
+    texts = ["Server {} user {} has joined the channel".format(i % servers, i) for i in range(joins)]
+    results = await asyncio.gather(*(cache.get(text, "en") for text in texts), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    beat.cancel()
+    await asyncio.gather(*cache.pending.values(), return_exceptions=True)
+    cache.close()
+    failed = sum(isinstance(result, Exception) for result in results)
+    print("{} joins across {} servers, {:.0f} ms per clip, {} workers".format(
+        joins, servers, latency * 1000, on_join.TTS_WORKERS))
+    print("Total: {:.2f} s".format(elapsed))
+    print("Failed or timed out: {}".format(failed))
+    print("Event loop lag: max {:.1f} ms, mean {:.1f} ms".format(
+        max(lag, default=0) * 1000, sum(lag) / max(len(lag), 1) * 1000))
+
+
+def main(joins=100, servers=10, latency=0.2):
+    with tempfile.TemporaryDirectory() as path:
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(benchmark(loop, path, int(joins), int(servers), float(latency)))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:4])
@@ -0,0 +1,102 @@
+"""CPU used by VoicePlayer.play while many voice clients play long clips.
+
+Plays one clip of SECONDS on each of CLIENTS servers at once through stub
+voice clients, whose players call their after callback from a timer thread
+the way discord's player threads do when a clip ends.
+
+    PYTHONPATH=path/to/Red-DiscordBot python benchmarks/voice_player.py [clients] [seconds]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from loader import load_cog
+
+voice_player = load_cog("voice_player")
+
+
+class Server:
+    def __init__(self, id):
+        self.id = id
+
+
+class Channel:
+    is_private = False
+    user_limit = 0
+    voice_members = ()
+
+    def __init__(self, server):
+        self.id = server.id
+        self.server = server
+
+
+class Player:
+    """Stands in for an ffmpeg player, ending after a number of seconds"""
+
+    def __init__(self, seconds, after):
+        self.timer = threading.Timer(seconds, after)
+
+    def start(self):
+        self.timer.start()
+
+    def stop(self):
+        self.timer.cancel()
+
+
+class VoiceClient:
+    def __init__(self, channel, seconds):
+        self.channel = channel
+        self.seconds = seconds
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self):
+        pass
+
+    def create_ffmpeg_player(self, path, after=None, **kwargs):
+        return Player(self.seconds, after)
+
+
+class Bot:
+    def __init__(self, loop, seconds):
+        self.loop = loop
+        self.seconds = seconds
+        self.voice_clients = {}
+
+    def voice_client_in(self, server):
+        return self.voice_clients.get(server)
+
+    async def join_voice_channel(self, channel):
+        self.voice_clients[channel.server] = VoiceClient(channel, self.seconds)
+        return self.voice_clients[channel.server]
+
+
+async def benchmark(loop, clients, seconds):
+    bot = Bot(loop, seconds)
+    player = voice_player.VoicePlayer(bot)
+    channels = [Channel(Server(id)) for id in range(clients)]
+    # A path that doesn't exist is never decoded into the PCM cache, so every clip goes to the ffmpeg player
+    start, cpu = time.perf_counter(), time.process_time()
+    await asyncio.gather(*(player.play(channel.server, channel, "missing.mp3") for channel in channels))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - start
+    player._VoicePlayer__unload()
+    print("{} voice clients playing {} second clips".format(clients, seconds))
+    print("CPU:        {:.1f} ms ({:.3f} ms per client-second)".format(cpu * 1000, cpu * 1000 / clients / seconds))
+    print("Wall time:  {:.3f} s".format(wall))
+
+
+def main(clients=50, seconds=10):
+    with tempfile.TemporaryDirectory() as data:
+        os.chdir(data)
+        voice_player.check_folders()
+        voice_player.check_files()
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(benchmark(loop, clients, seconds))
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:3]))
@@ -0,0 +1,55 @@
+"""Time to the first audio frame of a clip, through ffmpeg and from the PcmCache.
+
+Spawns the ffmpeg decode that create_ffmpeg_player runs and times its first
+frame, then times PcmCache.get handing the cached clip's first frame over.
+
+    PYTHONPATH=path/to/Red-DiscordBot python benchmarks/voice_player_first_audio.py clip.mp3 [runs]
+"""
+import asyncio
+import subprocess
+import sys
+import time
+from io import BytesIO
+
+from loader import load_cog
+
+voice_player = load_cog("voice_player")
+
+
+def time_ffmpeg(path, runs):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.Popen(voice_player.ffmpeg_args(path), stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL)
+        process.stdout.read(voice_player.FRAME_BYTES)
+        times.append(time.perf_counter() - start)
+        process.kill()
+        process.communicate()
+    return times
+
+
+async def time_cache(loop, path, runs):
+    cache = voice_player.PcmCache(loop, 1024 ** 3)
+    await cache.get(path, always=True)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        pcm = await cache.get(path)
+        BytesIO(pcm).read(voice_player.FRAME_BYTES)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def main(path, runs=10):
+    loop = asyncio.get_event_loop()
+    print("Time to first audio frame of {}, {} runs".format(path, runs))
+    print("{:<10}{:>14}{:>14}".format("Source", "Median (ms)", "Max (ms)"))
+    for name, times in (("ffmpeg", time_ffmpeg(path, runs)),
+                        ("memory", loop.run_until_complete(time_cache(loop, path, runs)))):
+        times.sort()
+        print("{:<10}{:>14.3f}{:>14.3f}".format(name, times[len(times) // 2] * 1000, times[-1] * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1], *map(int, sys.argv[2:3]))
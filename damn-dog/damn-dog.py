@@ -1,14 +1,26 @@
 import asyncio
+import hashlib
+import json
+import math
 import os
 import time
-from collections import Counter, defaultdict
+from array import array
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
 from os import listdir
 from os.path import isfile, join
-from random import choice
+from random import sample, shuffle
+from types import MappingProxyType
 
+import aiohttp
 import discord
 from discord.ext import commands
+from PIL import Image
 
+from __main__ import send_cmd_help
 from .utils import checks
 from .utils.chat_formatting import box
 from .utils.dataIO import dataIO
@@ -18,9 +30,503 @@ DEFAULTS = {
     "TIMEOUT": 120,
     "DELAY": 15,
     "BOT_PLAYS": False,
-    "REVEAL_ANSWER": True
+    "REVEAL_ANSWER": True,
+    "DIFFICULTY": "normal"
 }
 
+SETTINGS_PATH = "data/damn-dog/settings.json"
+IMG_PATH = "data/damn-dog/img"
+CACHE_PATH = "data/damn-dog/cache"
+IMAGE_SETTINGS_PATH = "data/damn-dog/images.json"
+URL_CACHE_PATH = "data/damn-dog/urls.json"
+STATS_PATH = "data/damn-dog/stats.json"
+STATS_LOG_PATH = "data/damn-dog/stats.log"
+METRICS_PATH = "data/damn-dog/metrics.json"
+CHOICES = 4
+IMAGE_DEFAULTS = {
+    "MAX_DIMENSION": 640,
+    "MAX_BYTES": 100 * 1024
+}
+IMAGE_LRU_SIZE = 64
+IMAGE_WORKERS = 2
+URL_VERIFY_INTERVAL = 3600
+STATS_FLUSH_INTERVAL = 10
+STATS_FLUSH_THRESHOLD = 50
+STATS_COMPACT_LINES = 5000
+SETTINGS_SAVE_DELAY = 5
+LOBBY_SETTLE = 0.5
+METRICS_WINDOW = 1000
+METRICS_PERCENTILES = (50, 95, 99)
+
+DIFFICULTIES = OrderedDict([
+    ("easy", None),
+    ("normal", 40),
+    ("hard", 10)
+])
+
+
+def title_terms(title):
+    """The words of a title and the character trigrams of each word"""
+    for word in title.lower().split():
+        yield word
+        padded = "#{}#".format(word)
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+
+def similarity_ranking(titles):
+    """Ranks, for every title, every other title from most to least similar.
+
+    Similarity is the cosine of TF-IDF vectors over title_terms. Titles that
+    share no terms follow in index order."""
+    docs = [Counter(title_terms(title)) for title in titles]
+    df = Counter(term for doc in docs for term in doc)
+    postings = defaultdict(list)
+    for i, doc in enumerate(docs):
+        weights = {term: tf * math.log(len(docs) / df[term]) for term, tf in doc.items()}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1
+        for term, weight in weights.items():
+            if weight:
+                postings[term].append((i, weight / norm))
+    scores = [defaultdict(float) for _ in docs]
+    for posting in postings.values():
+        for i, wi in posting:
+            row = scores[i]
+            for j, wj in posting:
+                row[j] += wi * wj
+    ranking = []
+    for i, row in enumerate(scores):
+        row.pop(i, None)
+        similar = sorted(row, key=row.get, reverse=True)
+        rest = (j for j in range(len(docs)) if j != i and j not in row)
+        ranking.append(array("H", similar + list(rest)))
+    return tuple(ranking)
+
+
+class Questions(namedtuple("Questions", "titles filenames similar")):
+    __slots__ = ()
+
+    def distractors(self, question, difficulty):
+        """Draws distinct wrong answers for a question in O(k).
+
+        Harder difficulties draw from a narrower window of the most similar titles."""
+        k = min(CHOICES - 1, len(self.titles) - 1)
+        window = DIFFICULTIES[difficulty]
+        if window is None:
+            picks = sample(range(len(self.titles) - 1), k)
+            return [p if p < question else p + 1 for p in picks]
+        similar = self.similar[question]
+        return [similar[p] for p in sample(range(min(window, len(similar))), k)]
+
+
+class QuestionBank:
+    """The damn.dog question titles and image filenames, read from disk once.
+
+    The image folder is listed again only when its mtime changes. Sessions
+    hold on to the Questions snapshot they started with."""
+
+    def __init__(self, path=IMG_PATH):
+        self.path = path
+        self.mtime = None
+        self.questions = Questions((), (), ())
+
+    def get(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self.mtime:
+            self.questions = self.load()
+            self.mtime = mtime
+        return self.questions
+
+    def load(self):
+        filenames = sorted(f for f in listdir(self.path) if isfile(join(self.path, f)))
+        titles = tuple(os.path.splitext(fn)[0].replace('-', ' ') for fn in filenames)
+        return Questions(titles, tuple(filenames), similarity_ranking(titles))
+
+
+def prepare_image(source, cache_path, max_dimension, max_bytes):
+    """Resizes and recompresses one image into the cache, keyed by its content hash.
+
+    Runs in a worker process. Returns the cached file's path and the source and
+    prepared sizes. Images already within both limits are copied as they are,
+    and so are images no re-encode makes smaller."""
+    with open(source, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha1(data)
+    digest.update("{}:{}:smallest".format(max_dimension, max_bytes).encode())
+    target = join(cache_path, digest.hexdigest() + ".jpg")
+    if isfile(target):
+        return target, len(data), os.path.getsize(target)
+    im = Image.open(BytesIO(data))
+    prepared = data
+    if max(im.size) > max_dimension or len(data) > max_bytes:
+        im = im.convert("RGB")
+        im.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        for quality in (85, 75, 65, 55, 45, 35):
+            buffer = BytesIO()
+            im.save(buffer, "JPEG", quality=quality, optimize=True)
+            encoded = buffer.getvalue()
+            if len(encoded) < len(prepared):
+                prepared = encoded
+            if len(encoded) <= max_bytes:
+                break
+    tmp = target + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(prepared)
+    os.replace(tmp, target)
+    return target, len(data), len(prepared)
+
+
+class ImageCache:
+    """Question images resized and recompressed once, served from memory.
+
+    Prepared files live in CACHE_PATH under the hash of their source content
+    and the size limits, so an unchanged image is never prepared twice. Rounds
+    read them through a small LRU of bytes, falling back to the original image
+    if it has not been prepared yet."""
+
+    def __init__(self, bot, path=CACHE_PATH, lru_size=IMAGE_LRU_SIZE):
+        self.bot = bot
+        self.path = path
+        self.lru_size = lru_size
+        self.settings = dict(IMAGE_DEFAULTS, **dataIO.load_json(IMAGE_SETTINGS_PATH))
+        self.prepared = {}
+        self.lru = OrderedDict()
+        self.stats = Counter()
+        self.executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+
+    async def prepare(self, questions, source_path=IMG_PATH):
+        """Prepares every question image in the process pool and drops stale cache files"""
+        max_dimension = self.settings["MAX_DIMENSION"]
+        max_bytes = self.settings["MAX_BYTES"]
+        jobs = [self.bot.loop.run_in_executor(self.executor, prepare_image, join(source_path, fn),
+                                              self.path, max_dimension, max_bytes)
+                for fn in questions.filenames]
+        results = await asyncio.gather(*jobs)
+        self.prepared = {fn: target for fn, (target, _, _) in zip(questions.filenames, results)}
+        self.lru.clear()
+        keep = {os.path.basename(target) for target in self.prepared.values()}
+        for fn in listdir(self.path):
+            if fn not in keep:
+                os.remove(join(self.path, fn))
+        return sum(r[1] for r in results), sum(r[2] for r in results)
+
+    def key(self, filename, source_path=IMG_PATH):
+        """Returns the content hash of the bytes uploaded for a question image"""
+        if filename in self.prepared:
+            return os.path.splitext(os.path.basename(self.prepared[filename]))[0]
+        return hashlib.sha1(self.get(filename, source_path)).hexdigest()
+
+    def get(self, filename, source_path=IMG_PATH):
+        """Returns the bytes to upload for a question image"""
+        data = self.lru.get(filename)
+        if data is not None:
+            self.lru.move_to_end(filename)
+            self.stats["hits"] += 1
+            return data
+        self.stats["misses"] += 1
+        with open(self.prepared.get(filename, join(source_path, filename)), "rb") as f:
+            data = f.read()
+        self.lru[filename] = data
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+        return data
+
+    def save_settings(self):
+        dataIO.save_json(IMAGE_SETTINGS_PATH, self.settings)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class UrlCache:
+    """Attachment URLs of question images already uploaded, keyed by content hash.
+
+    A URL is checked again once it is older than URL_VERIFY_INTERVAL and is
+    forgotten when it no longer resolves, so the next round uploads the image
+    again."""
+
+    def __init__(self, path=URL_CACHE_PATH, verify_interval=URL_VERIFY_INTERVAL):
+        self.path = path
+        self.verify_interval = verify_interval
+        self.entries = dataIO.load_json(path)
+        self.stats = Counter()
+
+    async def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if time.time() - entry["VERIFIED"] > self.verify_interval:
+            if not await self.resolves(entry["URL"]):
+                self.invalidate(key)
+                self.stats["misses"] += 1
+                return None
+            entry["VERIFIED"] = time.time()
+            self.save()
+        self.stats["hits"] += 1
+        return entry["URL"]
+
+    def put(self, key, url):
+        self.entries[key] = {"URL": url, "VERIFIED": time.time()}
+        self.save()
+
+    def invalidate(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.stats["invalidated"] += 1
+            self.save()
+
+    @staticmethod
+    async def resolves(url):
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.head(url) as response:
+                    return response.status == 200
+        except aiohttp.ClientError:
+            return False
+
+    def save(self):
+        dataIO.save_json(self.path, self.entries)
+
+
+def new_answer_stats():
+    return {"CORRECT": 0, "WRONG": 0, "LATENCY": 0.0}
+
+
+def new_user_stats():
+    stats = new_answer_stats()
+    stats.update({"GAMES": 0, "WINS": 0})
+    return stats
+
+
+def answer_summary(stats):
+    """Accuracy and average response time of a user or question"""
+    answers = stats["CORRECT"] + stats["WRONG"]
+    if not answers:
+        return 0.0, 0.0
+    return stats["CORRECT"] / answers, stats["LATENCY"] / answers
+
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class RoundMetrics:
+    """Latency of each stage of a round and per-server round counters.
+
+    Every stage keeps its last METRICS_WINDOW samples, so recording is O(1)
+    and percentiles are only sorted out when someone asks for them.
+
+    Stages:
+      gateway  message creation to on_message
+      answer   on_message to the correct-answer reply being sent
+      check    matching a guess against the choices
+      reply    sending the correct-answer reply
+      upload   posting the question image
+      choices  sending the list of choices
+      reveal   sending the unanswered-round message"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.stages = defaultdict(lambda: deque(maxlen=window))
+        self.servers = defaultdict(Counter)
+
+    def observe(self, stage, seconds):
+        self.stages[stage].append(seconds)
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def count(self, server_id, event):
+        self.servers[server_id][event] += 1
+
+    def summary(self):
+        """Sample count and p50/p95/p99 in milliseconds for every stage"""
+        summary = OrderedDict()
+        for stage in sorted(self.stages):
+            ordered = sorted(self.stages[stage])
+            if ordered:
+                summary[stage] = [len(ordered)] + [percentile(ordered, p) * 1000 for p in METRICS_PERCENTILES]
+        return summary
+
+    def dump(self):
+        stages = {}
+        for stage, (samples, *percentiles) in self.summary().items():
+            stages[stage] = {"SAMPLES": samples}
+            for p, value in zip(METRICS_PERCENTILES, percentiles):
+                stages[stage]["P{}_MS".format(p)] = round(value, 3)
+        return {"STAGES": stages, "SERVERS": self.servers}
+
+
+class StatsStore:
+    """Per-server damn.dog answers, response times and games, kept as running totals.
+
+    Every recorded event updates the totals in memory and is queued for an
+    append-only log, written in batches every STATS_FLUSH_INTERVAL seconds or
+    STATS_FLUSH_THRESHOLD events. Once the log grows past STATS_COMPACT_LINES
+    the totals are saved as a snapshot and the log starts over. Events carry a
+    sequence number, so those already in the snapshot are skipped on replay."""
+
+    def __init__(self, bot, path=STATS_PATH, log_path=STATS_LOG_PATH):
+        self.bot = bot
+        self.path = path
+        self.log_path = log_path
+        snapshot = dataIO.load_json(path) if isfile(path) else {"SEQ": 0, "SERVERS": {}}
+        self.seq = snapshot["SEQ"]
+        self.servers = snapshot["SERVERS"]
+        self.log_lines = 0
+        if isfile(log_path):
+            with open(log_path) as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    self.log_lines += 1
+                    if event["SEQ"] > self.seq:
+                        self.apply(event)
+                        self.seq = event["SEQ"]
+        self.pending = []
+        self.lock = asyncio.Lock()
+        self.flusher = bot.loop.create_task(self.flush_periodically())
+
+    def get_server(self, server_id):
+        return self.servers.setdefault(server_id, {"GAMES": 0, "USERS": {}, "QUESTIONS": {}})
+
+    def record_answer(self, server_id, user_id, question, correct, latency):
+        self.record({"TYPE": "answer", "SERVER": server_id, "USER": user_id,
+                     "QUESTION": question, "CORRECT": correct, "LATENCY": round(latency, 3)})
+
+    def record_game(self, server_id, players, winner):
+        self.record({"TYPE": "game", "SERVER": server_id, "PLAYERS": players, "WINNER": winner})
+
+    def record(self, event):
+        self.seq += 1
+        event["SEQ"] = self.seq
+        self.apply(event)
+        self.pending.append(event)
+        if len(self.pending) >= STATS_FLUSH_THRESHOLD:
+            self.bot.loop.create_task(self.flush())
+
+    def apply(self, event):
+        server = self.get_server(event["SERVER"])
+        users = server["USERS"]
+        if event["TYPE"] == "answer":
+            user = users.setdefault(event["USER"], new_user_stats())
+            question = server["QUESTIONS"].setdefault(event["QUESTION"], new_answer_stats())
+            result = "CORRECT" if event["CORRECT"] else "WRONG"
+            for stats in (user, question):
+                stats[result] += 1
+                stats["LATENCY"] += event["LATENCY"]
+        elif event["TYPE"] == "game":
+            server["GAMES"] += 1
+            for user_id in event["PLAYERS"]:
+                users.setdefault(user_id, new_user_stats())["GAMES"] += 1
+            if event["WINNER"] is not None:
+                users.setdefault(event["WINNER"], new_user_stats())["WINS"] += 1
+
+    def get_top(self, server_id, count=10):
+        users = self.get_server(server_id)["USERS"]
+        ranked = sorted(users.items(), key=lambda kv: (kv[1]["CORRECT"], kv[1]["WINS"]), reverse=True)
+        return ranked[:count]
+
+    def get_user(self, server_id, user_id):
+        return self.get_server(server_id)["USERS"].get(user_id)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(STATS_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+            events, self.pending = self.pending, []
+            lines = "".join(json.dumps(event) + "\n" for event in events)
+            await self.bot.loop.run_in_executor(None, self.append, lines)
+            self.log_lines += len(events)
+            if self.log_lines >= STATS_COMPACT_LINES:
+                snapshot = json.dumps({"SEQ": self.seq, "SERVERS": self.servers})
+                await self.bot.loop.run_in_executor(None, self.compact, snapshot)
+                self.log_lines = 0
+
+    def append(self, lines):
+        with open(self.log_path, "a") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def compact(self, snapshot):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        open(self.log_path, "w").close()
+
+    def close(self):
+        self.flusher.cancel()
+        if self.pending:
+            self.append("".join(json.dumps(event) + "\n" for event in self.pending))
+            self.pending = []
+
+
+class ServerSettings:
+    """Per-server settings, storing only the values that differ from DEFAULTS.
+
+    get returns a read-only snapshot that is rebuilt only after a change, so
+    sessions keep the settings they started with. Changes are written to disk
+    SETTINGS_SAVE_DELAY seconds after the last one."""
+
+    def __init__(self, bot, path=SETTINGS_PATH):
+        self.bot = bot
+        self.path = path
+        self.overrides = {}
+        for server_id, server in dataIO.load_json(path).items():
+            for key, value in server.items():
+                if key in DEFAULTS and value != DEFAULTS[key]:
+                    self.overrides.setdefault(server_id, {})[key] = value
+        self.defaults = MappingProxyType(DEFAULTS.copy())
+        self.snapshots = {}
+        self.pending_save = None
+
+    def get(self, server_id):
+        if server_id not in self.overrides:
+            return self.defaults
+        snapshot = self.snapshots.get(server_id)
+        if snapshot is None:
+            snapshot = MappingProxyType(dict(DEFAULTS, **self.overrides[server_id]))
+            self.snapshots[server_id] = snapshot
+        return snapshot
+
+    def set(self, server_id, key, value):
+        server = self.overrides.setdefault(server_id, {})
+        if value == DEFAULTS[key]:
+            server.pop(key, None)
+            if not server:
+                del self.overrides[server_id]
+        else:
+            server[key] = value
+        self.snapshots.pop(server_id, None)
+        if self.pending_save is not None:
+            self.pending_save.cancel()
+        self.pending_save = self.bot.loop.call_later(SETTINGS_SAVE_DELAY, self.save)
+
+    def save(self):
+        self.pending_save = None
+        dataIO.save_json(self.path, self.overrides)
+
+    def close(self):
+        if self.pending_save is not None:
+            self.pending_save.cancel()
+            self.save()
+
 
 # this comment forces an update
 
@@ -29,10 +535,16 @@ class DamnDog:
 
     def __init__(self, bot):
         self.bot = bot
-        self.damn_sessions = []
-        self.file_path = "data/damn-dog/settings.json"
-        settings = dataIO.load_json(self.file_path)
-        self.settings = defaultdict(lambda: DEFAULTS.copy(), settings)
+        self.damn_sessions = {}
+        self.lobbies = {}
+        self.question_bank = QuestionBank()
+        self.images = ImageCache(bot)
+        self.urls = UrlCache()
+        self.stats = StatsStore(bot)
+        self.metrics = RoundMetrics()
+        self.prepare_task = bot.loop.create_task(self.prepare_images())
+        self.message_stats = Counter()
+        self.settings = ServerSettings(bot)
 
     @commands.group(pass_context=True, no_pm=True)
     @checks.mod_or_permissions(administrator=True)
@@ -40,11 +552,12 @@ class DamnDog:
         """Change DamnDog Settings"""
         server = ctx.message.server
         if ctx.invoked_subcommand is None:
-            settings = self.settings[server.id]
+            settings = self.settings.get(server.id)
             msg = box("Redbot gains points: {BOT_PLAYS}\n"
                       "Seconds to answer: {DELAY}\n"
                       "Points to win: {MAX_SCORE}\n"
                       "Reveal answer on timeout: {REVEAL_ANSWER}\n"
+                      "Difficulty: {DIFFICULTY}\n"
                       "".format(**settings))
             msg += "\nSee {}help damnset to edit the settings".format(ctx.prefix)
             await self.bot.say(msg)
@@ -54,8 +567,7 @@ class DamnDog:
         """Points required to win"""
         server = ctx.message.server
         if score > 0:
-            self.settings[server.id]["MAX_SCORE"] = score
-            self.save_settings()
+            self.settings.set(server.id, "MAX_SCORE", score)
             await self.bot.say("Points required to win set to {}".format(score))
         else:
             await self.bot.say("Score must be greater than 0.")
@@ -65,8 +577,7 @@ class DamnDog:
         """Maximum seconds to answer"""
         server = ctx.message.server
         if seconds > 4:
-            self.settings[server.id]["DELAY"] = seconds
-            self.save_settings()
+            self.settings.set(server.id, "DELAY", seconds)
             await self.bot.say("Maximum seconds to answer set to {}".format(seconds))
         else:
             await self.bot.say("Seconds must be at least 5.")
@@ -75,25 +586,120 @@ class DamnDog:
     async def botplays(self, ctx):
         """Red gains points"""
         server = ctx.message.server
-        if self.settings[server.id]["BOT_PLAYS"]:
-            self.settings[server.id]["BOT_PLAYS"] = False
+        if self.settings.get(server.id)["BOT_PLAYS"]:
+            self.settings.set(server.id, "BOT_PLAYS", False)
             await self.bot.say("Alright, I won't embarrass you at Damn.Dog anymore.")
         else:
-            self.settings[server.id]["BOT_PLAYS"] = True
+            self.settings.set(server.id, "BOT_PLAYS", True)
             await self.bot.say("I'll gain a point every time you don't answer in time.")
-        self.save_settings()
 
     @damnset.command(pass_context=True)
     async def revealanswer(self, ctx):
         """Reveals answer to the question on timeout"""
         server = ctx.message.server
-        if self.settings[server.id]["REVEAL_ANSWER"]:
-            self.settings[server.id]["REVEAL_ANSWER"] = False
+        if self.settings.get(server.id)["REVEAL_ANSWER"]:
+            self.settings.set(server.id, "REVEAL_ANSWER", False)
             await self.bot.say("I won't reveal the answer to the questions anymore.")
         else:
-            self.settings[server.id]["REVEAL_ANSWER"] = True
+            self.settings.set(server.id, "REVEAL_ANSWER", True)
             await self.bot.say("I'll reveal the answer if no one knows it.")
-        self.save_settings()
+
+    @damnset.command(pass_context=True)
+    async def difficulty(self, ctx, level: str):
+        """How similar the wrong answers are to the right one: easy, normal or hard"""
+        server = ctx.message.server
+        level = level.lower()
+        if level in DIFFICULTIES:
+            self.settings.set(server.id, "DIFFICULTY", level)
+            await self.bot.say("Difficulty set to {}".format(level))
+        else:
+            await self.bot.say("Difficulty must be one of: {}".format(", ".join(DIFFICULTIES)))
+
+    @damnset.command(pass_context=True)
+    @checks.is_owner()
+    async def messagestats(self, ctx):
+        """Shows how many messages were filtered out or checked as answers"""
+        filtered = self.message_stats["filtered"]
+        dispatched = self.message_stats["dispatched"]
+        total = filtered + dispatched
+        msg = "Active sessions: {}\n".format(len(self.damn_sessions))
+        msg += "Messages seen: {}\n".format(total)
+        msg += "Filtered: {}\n".format(filtered)
+        msg += "Dispatched: {}\n".format(dispatched)
+        if total:
+            msg += "Dispatch rate: {:.2%}\n".format(dispatched / total)
+        await self.bot.say(box(msg))
+
+    @damnset.command(name="images", pass_context=True)
+    @checks.is_owner()
+    async def damn_images(self, ctx, max_dimension: int = None, max_kib: int = None):
+        """Resizes and recompresses the question images to the given limits"""
+        if max_dimension is not None:
+            if max_dimension < 64 or (max_kib is not None and max_kib < 8):
+                await self.bot.say("Images must be allowed at least 64 pixels and 8 KiB.")
+                return
+            self.images.settings["MAX_DIMENSION"] = max_dimension
+            if max_kib is not None:
+                self.images.settings["MAX_BYTES"] = max_kib * 1024
+            self.images.save_settings()
+        await self.bot.say("Preparing images, this may take a while...")
+        self.prepare_task.cancel()
+        self.prepare_task = self.bot.loop.create_task(self.prepare_images())
+        sizes = await self.prepare_task
+        if sizes is None:
+            await self.bot.say("The images could not be prepared, check your console.")
+            return
+        settings = self.images.settings
+        stats = self.images.stats
+        lookups = stats["hits"] + stats["misses"]
+        msg = "Images: {}\n".format(len(self.images.prepared))
+        msg += "Limits: {}px, {:.0f} KiB\n".format(settings["MAX_DIMENSION"], settings["MAX_BYTES"] / 1024)
+        msg += "Original: {:.1f} MiB\n".format(sizes[0] / 1024 ** 2)
+        msg += "Prepared: {:.1f} MiB\n".format(sizes[1] / 1024 ** 2)
+        if lookups:
+            msg += "Memory cache hit rate: {:.2%}\n".format(stats["hits"] / lookups)
+        await self.bot.say(box(msg))
+
+    @damnset.command(pass_context=True)
+    @checks.is_owner()
+    async def uploads(self, ctx):
+        """Shows how often question images were reused instead of uploaded"""
+        stats = self.urls.stats
+        lookups = stats["hits"] + stats["misses"]
+        msg = "Cached URLs: {}\n".format(len(self.urls.entries))
+        msg += "Reused: {}\n".format(stats["hits"])
+        msg += "Uploaded: {}\n".format(stats["misses"])
+        msg += "Invalidated: {}\n".format(stats["invalidated"])
+        msg += "Bytes uploaded: {:.1f} KiB\n".format(stats["uploaded bytes"] / 1024)
+        if lookups:
+            msg += "Hit rate: {:.2%}\n".format(stats["hits"] / lookups)
+            msg += "Bytes per round: {:.0f}\n".format(stats["uploaded bytes"] / lookups)
+        await self.bot.say(box(msg))
+
+    @damnset.group(pass_context=True, invoke_without_command=True)
+    async def latency(self, ctx):
+        """Shows round latency percentiles and this server's round counters"""
+        server = ctx.message.server
+        summary = self.metrics.summary()
+        msg = "{:<10}{:>8}".format("Stage", "Samples")
+        msg += "".join("{:>10}".format("p{} (ms)".format(p)) for p in METRICS_PERCENTILES) + "\n"
+        for stage, (samples, *percentiles) in summary.items():
+            msg += "{:<10}{:>8}".format(stage, samples)
+            msg += "".join("{:>10.1f}".format(value) for value in percentiles) + "\n"
+        if not summary:
+            msg += "No rounds timed yet.\n"
+        counters = self.metrics.servers[server.id]
+        msg += "\n"
+        for event in ("rounds", "answered", "timeouts", "reveals", "idle stops"):
+            msg += "{}: {}\n".format(event.capitalize(), counters[event])
+        await self.bot.say(box(msg))
+
+    @latency.command(name="dump")
+    @checks.is_owner()
+    async def latency_dump(self):
+        """Saves the latency histograms and all server counters as JSON"""
+        dataIO.save_json(METRICS_PATH, self.metrics.dump())
+        await self.bot.upload(METRICS_PATH)
 
     @commands.group(pass_context=True, invoke_without_command=True, no_pm=True)
     async def damndog(self, ctx):
@@ -101,36 +707,147 @@ class DamnDog:
         message = ctx.message
         server = message.server
         session = self.get_damn_by_channel(message.channel)
-        if not session:
-            try:
-                damn_questions = self.get_damn_data()
-            except Exception as e:
-                print(e)
-                await self.bot.say("There was an unknown error getting damn.dog data: {}".format(e))
-            else:
-                settings = self.settings[server.id]
-                d = DamnSession(self.bot, damn_questions, message, settings)
-                self.damn_sessions.append(d)
-                await d.new_question()
-        else:
+        if session:
             await self.bot.say("A damn.dog session is already ongoing in this channel.")
+        elif self.get_lobby_by_channel(message.channel):
+            await self.bot.say("This channel is waiting in a damn.dog lobby.")
+        else:
+            await self.start_session(message)
+
+    async def start_session(self, message, channels=()):
+        try:
+            damn_questions = self.get_damn_data()
+        except Exception as e:
+            print(e)
+            await self.bot.say("There was an unknown error getting damn.dog data: {}".format(e))
+        else:
+            settings = self.settings.get(message.server.id)
+            d = DamnSession(self.bot, damn_questions, self.images, self.urls, self.metrics, message, settings,
+                            channels)
+            for channel in d.channels:
+                self.damn_sessions[channel.id] = d
+            await d.run()
+
+    @damndog.group(pass_context=True, no_pm=True)
+    async def lobby(self, ctx):
+        """Play one damn.dog game across several channels or servers"""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+
+    @lobby.command(name="open", pass_context=True, no_pm=True)
+    async def lobby_open(self, ctx, name: str):
+        """Opens a lobby hosted in this channel"""
+        channel = ctx.message.channel
+        name = name.lower()
+        if self.get_damn_by_channel(channel) or self.get_lobby_by_channel(channel):
+            await self.bot.say("This channel is already playing or waiting in a lobby.")
+        elif name in self.lobbies:
+            await self.bot.say("There is already a lobby called {}.".format(name))
+        else:
+            self.lobbies[name] = Lobby(name, ctx.message)
+            await self.bot.say("Lobby **{0}** is open. Other channels can join with `{1}damndog lobby join {0}`, "
+                               "then start the game here with `{1}damndog lobby start`.".format(name, ctx.prefix))
+
+    @lobby.command(name="join", pass_context=True, no_pm=True)
+    async def lobby_join(self, ctx, name: str):
+        """Joins this channel to a lobby"""
+        channel = ctx.message.channel
+        lobby = self.lobbies.get(name.lower())
+        if not self.is_authorized(ctx.message.author):
+            await self.bot.say("You are not allowed to do that.")
+        elif self.get_damn_by_channel(channel) or self.get_lobby_by_channel(channel):
+            await self.bot.say("This channel is already playing or waiting in a lobby.")
+        elif lobby is None:
+            await self.bot.say("There is no lobby called {}.".format(name))
+        else:
+            lobby.channels.append(channel)
+            await self.bot.send_message(lobby.host, "#{} on {} joined the lobby.".format(channel.name, channel.server.name))
+            await self.bot.say("Joined lobby **{}** with {} other channel(s). "
+                               "The game starts when its host starts it.".format(lobby.name, len(lobby.channels) - 1))
+
+    @lobby.command(name="leave", pass_context=True, no_pm=True)
+    async def lobby_leave(self, ctx):
+        """Takes this channel out of the lobby it joined"""
+        channel = ctx.message.channel
+        lobby = self.get_lobby_by_channel(channel)
+        if lobby is None or lobby.host == channel:
+            await self.bot.say("This channel hasn't joined a lobby.")
+        elif not self.is_authorized(ctx.message.author):
+            await self.bot.say("You are not allowed to do that.")
+        else:
+            lobby.channels.remove(channel)
+            await self.bot.send_message(lobby.host, "#{} on {} left the lobby.".format(channel.name, channel.server.name))
+            await self.bot.say("Left lobby **{}**.".format(lobby.name))
+
+    @lobby.command(name="start", pass_context=True, no_pm=True)
+    async def lobby_start(self, ctx):
+        """Starts the game in every channel of the lobby hosted here"""
+        message = ctx.message
+        lobby = self.get_lobby_by_channel(message.channel)
+        if lobby is None or lobby.host != message.channel:
+            await self.bot.say("There's no lobby hosted in this channel.")
+        elif message.author != lobby.starter and not self.is_authorized(message.author):
+            await self.bot.say("You are not allowed to do that.")
+        else:
+            del self.lobbies[lobby.name]
+            await self.start_session(message, lobby.channels)
+
+    @lobby.command(name="cancel", pass_context=True, no_pm=True)
+    async def lobby_cancel(self, ctx):
+        """Closes the lobby hosted in this channel"""
+        message = ctx.message
+        lobby = self.get_lobby_by_channel(message.channel)
+        if lobby is None or lobby.host != message.channel:
+            await self.bot.say("There's no lobby hosted in this channel.")
+        elif message.author != lobby.starter and not self.is_authorized(message.author):
+            await self.bot.say("You are not allowed to do that.")
+        else:
+            del self.lobbies[lobby.name]
+            msg = "Lobby **{}** was cancelled.".format(lobby.name)
+            await asyncio.gather(*(self.bot.send_message(channel, msg) for channel in lobby.channels))
+
+    @damndog.command(pass_context=True, no_pm=True)
+    async def top(self, ctx):
+        """Shows the server's best damn.dog players"""
+        server = ctx.message.server
+        top = self.stats.get_top(server.id)
+        if not top:
+            await self.bot.say("Nobody has played damn.dog on this server yet.")
+            return
+        msg = "{:<4}{:<20}{:>8}{:>10}{:>9}{:>6}\n".format("#", "Name", "Correct", "Accuracy", "Avg (s)", "Wins")
+        for rank, (user_id, stats) in enumerate(top, 1):
+            member = server.get_member(user_id)
+            name = member.display_name if member else user_id
+            accuracy, latency = answer_summary(stats)
+            msg += "{:<4}{:<20}{:>8}{:>10.0%}{:>9.1f}{:>6}\n".format(rank, name[:19], stats["CORRECT"],
+                                                                  accuracy, latency, stats["WINS"])
+        await self.bot.say(box(msg))
+
+    @damndog.command(name="stats", pass_context=True, no_pm=True)
+    async def damn_stats(self, ctx, user: discord.Member = None):
+        """Shows a player's damn.dog stats"""
+        server = ctx.message.server
+        user = user or ctx.message.author
+        stats = self.stats.get_user(server.id, user.id)
+        if stats is None:
+            await self.bot.say("{} hasn't played damn.dog on this server yet.".format(user.display_name))
+            return
+        accuracy, latency = answer_summary(stats)
+        msg = "Correct answers: {CORRECT}\n" \
+              "Wrong answers: {WRONG}\n".format(**stats)
+        msg += "Accuracy: {:.1%}\n".format(accuracy)
+        msg += "Average response: {:.1f}s\n".format(latency)
+        msg += "Games played: {GAMES}\n" \
+               "Games won: {WINS}\n".format(**stats)
+        await self.bot.say("**{}**\n{}".format(user.display_name, box(msg)))
 
     @damndog.group(name="stop", pass_context=True, no_pm=True)
     async def damn_stop(self, ctx):
         """Stops an ongoing damndog session"""
         author = ctx.message.author
-        server = author.server
-        admin_role = self.bot.settings.get_server_admin(server)
-        mod_role = self.bot.settings.get_server_mod(server)
-        is_admin = discord.utils.get(author.roles, name=admin_role)
-        is_mod = discord.utils.get(author.roles, name=mod_role)
-        is_owner = author.id == self.bot.settings.owner
-        is_server_owner = author == server.owner
-        is_authorized = is_admin or is_mod or is_owner or is_server_owner
-
         session = self.get_damn_by_channel(ctx.message.channel)
         if session:
-            if author == session.starter or is_authorized:
+            if author == session.starter or self.is_authorized(author):
                 await session.end_game()
                 await self.bot.say("DamnDog stopped.")
             else:
@@ -139,125 +856,272 @@ class DamnDog:
             await self.bot.say("There's no damndog session ongoing in this channel.")
 
     def get_damn_data(self):
-        path = "data/damn-dog/img"
-        onlyfiles = [f for f in listdir(path) if isfile(join(path, f))]
-        img_dict = dict()
-        for idx, fn in enumerate(onlyfiles):
-            onlyfiles[idx] = fn.replace('-', ' ')[:-4]
-            img_dict[onlyfiles[idx]] = fn
-        return img_dict
+        return self.question_bank.get()
+
+    async def prepare_images(self):
+        try:
+            return await self.images.prepare(self.get_damn_data())
+        except Exception as e:
+            print("Could not prepare damn.dog images: {}".format(e))
+
+    def __unload(self):
+        self.prepare_task.cancel()
+        self.images.close()
+        self.stats.close()
+        self.settings.close()
+
+    def is_authorized(self, author):
+        server = author.server
+        admin_role = self.bot.settings.get_server_admin(server)
+        mod_role = self.bot.settings.get_server_mod(server)
+        is_admin = discord.utils.get(author.roles, name=admin_role)
+        is_mod = discord.utils.get(author.roles, name=mod_role)
+        is_owner = author.id == self.bot.settings.owner
+        is_server_owner = author == server.owner
+        return is_admin or is_mod or is_owner or is_server_owner
 
     def get_damn_by_channel(self, channel):
-        for d in self.damn_sessions:
-            if d.channel == channel:
-                return d
+        return self.damn_sessions.get(channel.id)
+
+    def get_lobby_by_channel(self, channel):
+        for lobby in self.lobbies.values():
+            if channel in lobby.channels:
+                return lobby
         return None
 
     async def on_message(self, message):
-        if message.author != self.bot.user:
-            session = self.get_damn_by_channel(message.channel)
-            if session:
-                await session.check_answer(message)
+        session = self.damn_sessions.get(message.channel.id)
+        if session is None or message.author == self.bot.user:
+            self.message_stats["filtered"] += 1
+            return
+        self.message_stats["dispatched"] += 1
+        received = time.perf_counter()
+        self.metrics.observe("gateway", max(0.0, (datetime.utcnow() - message.timestamp).total_seconds()))
+        if await session.check_answer(message):
+            self.metrics.observe("answer", time.perf_counter() - received)
+
+    async def on_damn_answer(self, instance, message, question, correct, latency):
+        self.stats.record_answer(message.server.id, message.author.id, question, correct, latency)
 
     async def on_damn_end(self, instance):
-        if instance in self.damn_sessions:
-            self.damn_sessions.remove(instance)
+        if self.damn_sessions.get(instance.channel.id) is not instance:
+            return
+        for channel in instance.channels:
+            del self.damn_sessions[channel.id]
+        winner = None
+        if instance.scores:
+            winner, score = instance.scores.most_common(1)[0]
+            if score < instance.settings["MAX_SCORE"] or winner == self.bot.user:
+                winner = None
+        players = defaultdict(list)
+        for user in instance.players:
+            players[user.server.id].append(user.id)
+        for server_id, user_ids in players.items():
+            winner_id = winner.id if winner is not None and winner.id in user_ids else None
+            self.stats.record_game(server_id, user_ids, winner_id)
 
-    def save_settings(self):
-        dataIO.save_json(self.file_path, self.settings)
+
+class Lobby:
+    """Channels, possibly on different servers, waiting to play one damn.dog game together"""
+
+    def __init__(self, name, message):
+        self.name = name
+        self.host = message.channel
+        self.starter = message.author
+        self.channels = [message.channel]
 
 
 class DamnSession:
-    def __init__(self, bot, damn_data, message, settings):
+    def __init__(self, bot, questions, images, urls, metrics, message, settings, channels=()):
         self.bot = bot
         self.reveal_message = "The answer is {}."
         self.fail_message = "On to the next one..."
         self.correct_answer = None
-        self.answer_set = set()
         self.answer_dict = dict()
         self.has_answered = set()
-        self.damn_data = damn_data
+        self.candidates = []
+        self.questions = questions
+        self.images = images
+        self.urls = urls
+        self.metrics = metrics
+        self.order = list(range(len(questions.titles)))
+        shuffle(self.order)
         self.channel = message.channel
+        self.channels = [message.channel] + [channel for channel in channels if channel != message.channel]
+        self.settle = LOBBY_SETTLE if len(self.channels) > 1 else 0
         self.starter = message.author
         self.scores = Counter()
+        self.players = set()
         self.status = "new question"
         self.timer = None
+        self.asked = None
         self.timeout = time.perf_counter()
         self.count = 0
         self.settings = settings
-        self.path = "data/damn-dog/img"
+        self.round_over = asyncio.Event()
+
+    @property
+    def server_ids(self):
+        return {channel.server.id for channel in self.channels}
+
+    async def broadcast(self, content=None, **kwargs):
+        """Sends the same message to every channel of the session at once"""
+        return await asyncio.gather(*(self.bot.send_message(channel, content, **kwargs)
+                                      for channel in self.channels))
 
     async def stop_damn(self):
         self.status = "stop"
+        self.round_over.set()
         self.bot.dispatch("damn_end", self)
 
     async def end_game(self):
         self.status = "stop"
+        self.round_over.set()
         if self.scores:
             await self.send_table()
         self.bot.dispatch("damn_end", self)
 
-    async def new_question(self):
-        for score in self.scores.values():
-            if score == self.settings["MAX_SCORE"]:
+    async def run(self):
+        """Plays rounds until someone reaches the max score, the questions run out, or the game stops"""
+        while self.status != "stop":
+            if self.settings["MAX_SCORE"] in self.scores.values() or not self.order:
                 await self.end_game()
-                return True
-        if self.damn_data == {}:
-            await self.end_game()
-            return True
-        self.correct_answer = choice(list(self.damn_data.keys()))
-        img = self.path + "/{}".format(self.damn_data[self.correct_answer])
-        self.answer_set.add(self.correct_answer)
-        del self.damn_data[self.correct_answer]
-        for _ in range(3):
-            self.answer_set.add(choice(list(self.damn_data.keys())))
+                return
+            await self.new_question()
+            if not await self.wait_for_answer():
+                return
+            if self.status == "stop":
+                return
+            if self.status != "correct answer":
+                await self.reveal_answer()
+            # The game can be stopped while the reveal or the pause between rounds is awaited
+            if self.status == "stop":
+                return
+            self.status = "new question"
+            await asyncio.sleep(3)
+
+    async def new_question(self):
+        self.round_over.clear()
+        titles = self.questions.titles
+        question = self.order.pop()
+        self.correct_answer = titles[question]
+        filename = self.questions.filenames[question]
+        choices = [question] + self.questions.distractors(question, self.settings["DIFFICULTY"])
+        shuffle(choices)
         self.status = "waiting for answer"
         self.count += 1
-        self.timer = int(time.perf_counter())
-        await self.bot.send_file(destination=self.channel, fp=img)
+        for server_id in self.server_ids:
+            self.metrics.count(server_id, "rounds")
+        self.timer = time.perf_counter()
+        self.asked = None
+        with self.metrics.timed("upload"):
+            await self.send_image(filename)
         msg = "Choices:\n"
-        for idx, ans in enumerate(self.answer_set, 1):
+        for idx, pick in enumerate(choices, 1):
             idx = str(idx)
-            self.answer_dict[ans] = idx
+            ans = titles[pick]
+            self.answer_dict[ans.lower()] = idx
             msg += "**{}.** {}\n".format(idx, ans)
-        await self.bot.say(msg)
+        with self.metrics.timed("choices"):
+            await self.broadcast(msg)
+        # Answer latency counts from when the choices are up, not from before the image upload
+        self.asked = time.perf_counter()
+
+    async def send_image(self, filename):
+        """Posts the question image, reusing its attachment URL if it was uploaded before.
+
+        Without a cached URL the image is uploaded to the first channel only,
+        and the other channels get an embed of the fresh attachment. Channels
+        where the embed fails get an upload of their own. The URL is only
+        forgotten if Discord rejects it, not if a channel lacks permissions."""
+        key = self.images.key(filename)
+        url = await self.urls.get(key)
+        channels = self.channels
+        if url is None:
+            url = await self.upload_image(key, filename, channels[0])
+            channels = channels[1:]
+            if url is None:
+                await asyncio.gather(*(self.upload_image(key, filename, channel) for channel in channels))
+                return
+        embed = discord.Embed()
+        embed.set_image(url=url)
+        results = await asyncio.gather(*(self.bot.send_message(channel, embed=embed) for channel in channels),
+                                       return_exceptions=True)
+        failed = [(channel, result) for channel, result in zip(channels, results)
+                  if isinstance(result, discord.HTTPException)]
+        bad_url = any(self.rejects_url(error) for _, error in failed)
+        if bad_url:
+            self.urls.invalidate(key)
+        await asyncio.gather(*(self.upload_image(key, filename, channel, remember=bad_url)
+                               for channel, _ in failed))
+
+    @staticmethod
+    def rejects_url(error):
+        """Whether an embed failed because of its image URL rather than the channel"""
+        return isinstance(error, discord.NotFound) or getattr(error.response, "status", None) == 400
+
+    async def upload_image(self, key, filename, channel, remember=True):
+        data = self.images.get(filename)
+        message = await self.bot.send_file(channel, BytesIO(data), filename=filename)
+        self.urls.stats["uploaded bytes"] += len(data)
+        if message.attachments and remember:
+            url = message.attachments[0]["url"]
+            self.urls.put(key, url)
+            return url
+        return None
+
+    async def wait_for_answer(self):
+        """Sleeps until the round is answered or stopped, or the DELAY deadline passes.
 
-        while self.status != "correct answer" and (abs(self.timer - int(time.perf_counter()))) <= self.settings[
-            "DELAY"]:
-            if abs(self.timeout - int(time.perf_counter())) >= self.settings["TIMEOUT"]:
-                await self.bot.say("I guess I'll stop then...")
+        Returns False if nobody has spoken for TIMEOUT seconds, in which case
+        the game is stopped. Wakes only when check_answer or a stop resolves
+        the round, or a deadline is due."""
+        deadline = self.timer + self.settings["DELAY"]
+        while not self.round_over.is_set():
+            now = time.perf_counter()
+            idle_deadline = self.timeout + self.settings["TIMEOUT"]
+            if now >= idle_deadline:
+                for server_id in self.server_ids:
+                    self.metrics.count(server_id, "idle stops")
+                await self.broadcast("I guess I'll stop then...")
                 await self.stop_damn()
-                return True
-            await asyncio.sleep(1)  # Waiting for an answer or for the time limit
-        if self.status == "correct answer":
-            self.status = "new question"
-            await asyncio.sleep(3)
-            if not self.status == "stop":
-                await self.new_question()
-        elif self.status == "stop":
-            return True
-        else:
+                return False
+            if now >= deadline:
+                break
+            try:
+                await asyncio.wait_for(self.round_over.wait(), timeout=min(deadline, idle_deadline) - now)
+            except asyncio.TimeoutError:
+                pass
+        return True
+
+    async def reveal_answer(self):
+        for server_id in self.server_ids:
+            self.metrics.count(server_id, "timeouts")
             if self.settings["REVEAL_ANSWER"]:
-                msg = self.reveal_message.format(self.correct_answer)
-            else:
-                msg = self.fail_message
-            if self.settings["BOT_PLAYS"]:
-                msg += " **+1** for me!"
-                self.scores[self.bot.user] += 1
-            self.reset_round()
-            await self.bot.say(msg)
-            await self.bot.type()
-            await asyncio.sleep(3)
-            if not self.status == "stop":
-                await self.new_question()
+                self.metrics.count(server_id, "reveals")
+        if self.settings["REVEAL_ANSWER"]:
+            msg = self.reveal_message.format(self.correct_answer)
+        else:
+            msg = self.fail_message
+        if self.settings["BOT_PLAYS"]:
+            msg += " **+1** for me!"
+            self.scores[self.bot.user] += 1
+        self.reset_round()
+        with self.metrics.timed("reveal"):
+            await self.broadcast(msg)
+        await asyncio.gather(*(self.bot.send_typing(channel) for channel in self.channels))
 
     async def send_table(self):
         t = "+ Results: \n\n"
         for user, score in self.scores.most_common():
             t += "+ {}\t{}\n".format(user, score)
-        await self.bot.say(box(t, lang="diff"))
+        await self.broadcast(box(t, lang="diff"))
 
     async def check_answer(self, message):
+        """Scores a guess, returning True if it won the round.
+
+        In a lobby the first correct guess holds the round open for LOBBY_SETTLE
+        seconds, and the correct guess with the earliest server timestamp wins."""
         if message.author == self.bot.user:
             return
         elif self.correct_answer is None:
@@ -268,30 +1132,50 @@ class DamnSession:
         self.timeout = time.perf_counter()
         has_guessed = False
 
-        answer = self.correct_answer.lower()
-        guess = message.content.lower()
-        if guess == self.answer_dict[answer]:
-            has_guessed = True
-
-        if has_guessed:
-            self.status = "correct answer"
-            self.scores[message.author] += 1
-            msg = "The correct answer was \"{}\"\n".format(self.correct_answer)
-            msg += "You got it {}! **+1** to you!".format(message.author.name)
-            await self.bot.send_message(message.channel, msg)
-            self.reset_round()
+        with self.metrics.timed("check"):
+            answer = self.correct_answer.lower()
+            guess = message.content.lower()
+            if guess == self.answer_dict[answer]:
+                has_guessed = True
+            is_choice = guess in self.answer_dict.values()
+        if is_choice:
+            self.players.add(message.author)
+            latency = time.perf_counter() - self.asked if self.asked is not None else 0.0
+            self.bot.dispatch("damn_answer", self, message, self.correct_answer, has_guessed, latency)
+
+        self.has_answered.add(message.author)
+        if not has_guessed:
+            return False
+        self.candidates.append(message)
+        if len(self.candidates) > 1:
+            return False
+        self.status = "correct answer"
+        if self.settle:
+            await asyncio.sleep(self.settle)
+        winner = min(self.candidates, key=lambda m: (m.timestamp, int(m.id)))
+        self.scores[winner.author] += 1
+        msg = "The correct answer was \"{}\"\n".format(self.correct_answer)
+        if self.settle:
+            msg += "{} got it first, in #{} on {}! **+1** to them!".format(winner.author.name, winner.channel.name,
+                                                                        winner.server.name)
         else:
-            self.has_answered.add(message.author)
+            msg += "You got it {}! **+1** to you!".format(winner.author.name)
+        self.metrics.count(winner.server.id, "answered")
+        self.reset_round()
+        self.round_over.set()
+        with self.metrics.timed("reply"):
+            await self.broadcast(msg)
+        return winner is message
 
     def reset_round(self):
         self.correct_answer = None
         self.answer_dict = dict()
-        self.answer_set = set()
         self.has_answered = set()
+        self.candidates = []
 
 
 def check_folders():
-    folders = ("data", "data/img/")
+    folders = ("data", "data/img/", CACHE_PATH)
     for folder in folders:
         if not os.path.exists(folder):
             print("Creating " + folder + " folder...")
@@ -299,9 +1183,15 @@ def check_folders():
 
 
 def check_files():
-    if not os.path.isfile("data/damn-dog/settings.json"):
+    if not os.path.isfile(SETTINGS_PATH):
         print("Creating empty settings.json")
-        dataIO.save_json("data/damn-dog/settings.json", {})
+        dataIO.save_json(SETTINGS_PATH, {})
+    if not os.path.isfile(URL_CACHE_PATH):
+        print("Creating empty urls.json")
+        dataIO.save_json(URL_CACHE_PATH, {})
+    if not os.path.isfile(IMAGE_SETTINGS_PATH):
+        print("Creating default images.json")
+        dataIO.save_json(IMAGE_SETTINGS_PATH, IMAGE_DEFAULTS)
 
 
 def setup(bot):
@@ -1,15 +1,27 @@
-from .sfx import Sfx
-
 import discord
 import os
+import tempfile
 from cogs.utils.dataIO import dataIO
+from gtts import gTTS
 
 
 class OnJoin:
 
     def __init__(self, bot):
         self.bot = bot
-        self.sfx = Sfx(self.bot)
+
+    async def announce(self, server: discord.Server, channel: discord.Channel, text: str):
+        player = self.bot.get_cog("VoicePlayer")
+        if player is None:
+            print("on-join-sfx: load the voice_player cog to play announcements")
+            return
+        fd, path = tempfile.mkstemp(suffix=".mp3", dir="data/on_join")
+        os.close(fd)
+        try:
+            await self.bot.loop.run_in_executor(None, gTTS(text=text, lang="en").save, path)
+            await player.play(server, channel, path)
+        finally:
+            os.remove(path)
 
     async def voice_state_update(self, before: discord.Member, after: discord.Member):
         bserver = before.server
@@ -35,7 +47,7 @@ class OnJoin:
                 server = bserver
             else:
                 return
-            self.sfx.enqueue_tts(channel, text)
+            await self.announce(server, channel, text)
 
 
 
@@ -1,12 +1,18 @@
 import asyncio
+import hashlib
 import os
 import re
+import subprocess
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 
 import discord
 from cogs.utils.dataIO import dataIO
 from discord.ext import commands
 from gtts import gTTS
 
+from __main__ import send_cmd_help
 from .utils import checks
 
 emoji_pattern = re.compile("["
@@ -16,6 +22,16 @@ emoji_pattern = re.compile("["
                            u"\U0001F1E0-\U0001F1FF"
                            "]+", flags=re.UNICODE)
 
+TTS_CACHE_PATH = "data/on_join/tts"
+TTS_CACHE_MB = 50
+TTS_WORKERS = 4
+TTS_TIMEOUT = 10
+QUEUE_DEPTH = 20
+QUEUE_DROP_POLICIES = ("oldest", "newest")
+COALESCE_WINDOW = 0.5
+COALESCE_NAMES = 2
+COALESCED_KINDS = ("joined", "left")
+
 locales = {
     'af': 'Afrikaans',
     'sq': 'Albanian',
@@ -73,12 +89,221 @@ locales = {
 }
 
 
+class GttsBackend:
+    """Google Translate's text-to-speech, through gTTS"""
+
+    def synthesize(self, text, locale, path):
+        gTTS(text=text, lang=locale).save(path)
+
+
+class EspeakBackend:
+    """The offline espeak engine, for bots without internet access to Google"""
+
+    def synthesize(self, text, locale, path):
+        subprocess.run(["espeak", "-v", locale, "-w", path, text], check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+TTS_BACKENDS = {
+    "gtts": GttsBackend,
+    "espeak": EspeakBackend
+}
+
+
+class TtsCache:
+    """Synthesized TTS clips on disk, named by the hash of their backend, locale and text.
+
+    Clips are synthesized by the backend in a pool of TTS_WORKERS threads, so
+    the event loop never waits on it, and callers give up after timeout
+    seconds. Concurrent requests for the same clip share one synthesis.
+
+    Clips are kept in least recently used order and the oldest are deleted
+    once the folder grows past max_bytes. Use order survives restarts through
+    the files' modification times."""
+
+    def __init__(self, loop, backend="gtts", path=TTS_CACHE_PATH, max_bytes=TTS_CACHE_MB * 1024 ** 2,
+                 workers=TTS_WORKERS, timeout=TTS_TIMEOUT):
+        self.loop = loop
+        self.backend_name = backend
+        self.backend = TTS_BACKENDS[backend]() if isinstance(backend, str) else backend
+        self.path = path
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.pending = {}
+        self.stats = Counter()
+        self.clips = OrderedDict()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        files = [os.path.join(path, fn) for fn in os.listdir(path) if fn.endswith(".mp3")]
+        for file in sorted(files, key=os.path.getmtime):
+            self.clips[file] = os.path.getsize(file)
+        self.size = sum(self.clips.values())
+
+    def key(self, text, locale):
+        digest = hashlib.sha1("{}\0{}\0{}".format(self.backend_name, locale, text).encode()).hexdigest()
+        return os.path.join(self.path, digest + ".mp3")
+
+    async def get(self, text, locale):
+        """Returns the path of the clip for text, synthesizing it only if it isn't cached.
+
+        Raises asyncio.TimeoutError if synthesis takes longer than the timeout,
+        or whatever the backend raised."""
+        path = self.key(text, locale)
+        if path in self.clips:
+            self.stats["hits"] += 1
+            self.clips.move_to_end(path)
+            os.utime(path)
+            return path
+        pending = self.pending.get(path)
+        if pending is None:
+            self.stats["misses"] += 1
+            if os.path.isfile(path):
+                # finished after its requester timed out
+                self.add(path)
+                return path
+            pending = self.loop.run_in_executor(self.executor, self.synthesize, text, locale, path)
+            self.pending[path] = pending
+            pending.add_done_callback(lambda _: self.pending.pop(path, None))
+        else:
+            self.stats["shared"] += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(pending), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            raise
+        if path not in self.clips:
+            self.add(path)
+        return path
+
+    def synthesize(self, text, locale, path):
+        tmp = "{}.{}.tmp".format(path, threading.get_ident())
+        self.backend.synthesize(text, locale, tmp)
+        os.replace(tmp, path)
+
+    def add(self, path):
+        self.clips[path] = os.path.getsize(path)
+        self.size += self.clips[path]
+        self.evict()
+
+    def evict(self, keep=1):
+        """Deletes the least recently used clips until the cache fits, sparing the newest keep"""
+        while self.size > self.max_bytes and len(self.clips) > keep:
+            path, size = self.clips.popitem(last=False)
+            self.size -= size
+            self.stats["evictions"] += 1
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        max_bytes, self.max_bytes = self.max_bytes, 0
+        self.evict(keep=0)
+        self.max_bytes = max_bytes
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def announcement_text(kind, names):
+    """'A has joined the channel', 'A and B have left the channel', 'A, B and 5 others have joined the channel'"""
+    if len(names) > COALESCE_NAMES + 1:
+        who = "{} and {} others".format(", ".join(names[:COALESCE_NAMES]), len(names) - COALESCE_NAMES)
+    elif len(names) > 1:
+        who = "{} and {}".format(", ".join(names[:-1]), names[-1])
+    else:
+        who = names[0]
+    return "{} {} {} the channel".format(who, "has" if len(names) == 1 else "have", kind)
+
+
+def coalesce(batch):
+    """Merges the joins and the leaves of each channel in a burst into one announcement.
+
+    batch is a list of (channel, kind, payload) in arrival order. Joins and
+    leaves carry a name and come out as (channel, "say", text); anything else
+    is passed through in place."""
+    merged = []
+    index = {}
+    for channel, kind, payload in batch:
+        if kind not in COALESCED_KINDS:
+            merged.append((channel, kind, payload))
+            continue
+        key = (channel.id, kind)
+        if key in index:
+            merged[index[key]][2].append(payload)
+        else:
+            index[key] = len(merged)
+            merged.append((channel, kind, [payload]))
+    return [(channel, "say", announcement_text(kind, payload)) if kind in COALESCED_KINDS
+            else (channel, kind, payload) for channel, kind, payload in merged]
+
+
+class AnnouncementQueue:
+    """A server's pending voice announcements, played one at a time by a single task.
+
+    The task waits COALESCE_WINDOW seconds after the first item of a burst,
+    then coalesces everything queued so far. Each clip plays to the end
+    before the next one starts. When more than depth items are waiting, the
+    drop policy discards either the oldest waiting item or the new one."""
+
+    def __init__(self, cog, server, depth=QUEUE_DEPTH, policy="oldest"):
+        self.cog = cog
+        self.server = server
+        self.depth = depth
+        self.policy = policy
+        self.items = deque()
+        self.ready = asyncio.Event()
+        self.stats = Counter()
+        self.task = cog.bot.loop.create_task(self.run())
+
+    def put(self, channel, kind, payload):
+        """Queues an announcement, returning False if it was dropped"""
+        if len(self.items) >= self.depth:
+            self.stats["dropped"] += 1
+            if self.policy == "newest":
+                return False
+            self.items.popleft()
+        self.items.append((channel, kind, payload))
+        self.stats["queued"] += 1
+        self.ready.set()
+        return True
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            await asyncio.sleep(COALESCE_WINDOW)
+            self.ready.clear()
+            batch = list(self.items)
+            self.items.clear()
+            announcements = coalesce(batch)
+            self.stats["coalesced"] += len(batch) - len(announcements)
+            for channel, kind, payload in announcements:
+                try:
+                    path = payload if kind == "sound" else await self.cog.synthesize(payload)
+                    if path is not None:
+                        await self.cog.sound_play(self.server, channel, path, static=kind == "sound")
+                        self.stats["played"] += 1
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print("on_join: couldn't play {} announcement in {}: {!r}".format(kind, channel, e))
+                    self.stats["failed"] += 1
+
+    def restart(self):
+        """Starts a new consumer task if the last one has ended"""
+        if self.task.done():
+            self.task = self.cog.bot.loop.create_task(self.run())
+
+    def close(self):
+        self.task.cancel()
+
+
 class OnJoin:
     """Uses gTTS to announce when a user joins the channel, like Teamspeak or Ventrillo"""
 
     def __init__(self, bot):
         self.bot = bot
-        self.audio_players = {}
         self.settings = dataIO.load_json("data/on_join/settings.json")
 
         self.save_path = "data/on_join/"
@@ -89,66 +314,53 @@ class OnJoin:
             self.settings["locale"] = "en-us"
         if "allow_emoji" not in self.settings.keys():
             self.settings["allow_emoji"] = True
-
-    def voice_channel_full(self, voice_channel: discord.Channel) -> bool:
-        return (voice_channel.user_limit != 0 and
-                len(voice_channel.voice_members) >= voice_channel.user_limit)
-
-    def voice_connected(self, server: discord.Server) -> bool:
-        return self.bot.is_voice_connected(server)
-
-    def voice_client(self, server: discord.Server) -> discord.VoiceClient:
-        return self.bot.voice_client_in(server)
-
-    async def _leave_voice_channel(self, server: discord.Server):
-        if not self.voice_connected(server):
-            return
-        voice_client = self.voice_client(server)
-
-        if server.id in self.audio_players:
-            self.audio_players[server.id].stop()
-        await voice_client.disconnect()
-
-    async def wait_for_disconnect(self, server: discord.Server):
-        while not self.audio_players[server.id].is_done():
-            await asyncio.sleep(0.01)
-        await self._leave_voice_channel(server)
-
-    async def sound_init(self, server: discord.Server, path: str):
-        options = "-filter \"volume=volume=1.00\""
-        voice_client = self.voice_client(server)
-        self.audio_players[server.id] = voice_client.create_ffmpeg_player(
-            path, options=options, use_avconv=True)
+        if "tts_cache_mb" not in self.settings.keys():
+            self.settings["tts_cache_mb"] = TTS_CACHE_MB
+        if "tts_backend" not in self.settings.keys():
+            self.settings["tts_backend"] = "gtts"
+        if "queue_depth" not in self.settings.keys():
+            self.settings["queue_depth"] = QUEUE_DEPTH
+        if "queue_drop" not in self.settings.keys():
+            self.settings["queue_drop"] = "oldest"
+
+        self.queues = {}
+
+        self.tts_cache = TtsCache(self.bot.loop, self.settings["tts_backend"],
+                                  max_bytes=self.settings["tts_cache_mb"] * 1024 ** 2)
+
+    def __unload(self):
+        for queue in self.queues.values():
+            queue.close()
+        self.tts_cache.close()
+
+    def announce(self, server: discord.Server, channel: discord.Channel, kind: str, payload: str) -> bool:
+        """Queues a join, leave, TTS message or sound file on the server's announcement queue"""
+        if channel is None:
+            return False
+        if server.id not in self.queues:
+            self.queues[server.id] = AnnouncementQueue(self, server, self.settings["queue_depth"],
+                                                       self.settings["queue_drop"])
+        self.queues[server.id].restart()
+        return self.queues[server.id].put(channel, kind, payload)
+
+    async def synthesize(self, text: str):
+        """Returns the path of a clip of text, or None if it couldn't be synthesized in time"""
+        try:
+            return await self.tts_cache.get(text, self.settings["locale"])
+        except asyncio.TimeoutError:
+            print("on_join: TTS for {!r} timed out".format(text))
+        except Exception as e:
+            print("on_join: TTS for {!r} failed: {}".format(text, e))
+        return None
 
     async def sound_play(self, server: discord.Server,
-                         channel: discord.Channel, p: str):
-        if self.voice_channel_full(channel):
+                         channel: discord.Channel, p: str, static: bool = False):
+        """Plays a clip in channel through the voice_player cog and returns once it has finished"""
+        player = self.bot.get_cog("VoicePlayer")
+        if player is None:
+            print("on_join: load the voice_player cog to play announcements")
             return
-
-        if not channel.is_private:
-            if self.voice_connected(server):
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
-            else:
-                await self.bot.join_voice_channel(channel)
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                    # await self.wait_for_disconnect(server)
+        await player.play(server, channel, p, use_avconv=True, static=static)
 
     async def voice_state_update(self, before: discord.Member, after: discord.Member):
         bserver = before.server
@@ -164,21 +376,21 @@ class OnJoin:
             # went from no channel to a channel
             if (bvchan is None and avchan is not None):
                 # came online
-                text = "{} has joined the channel".format(after.display_name)
+                kind = "joined"
+                name = after.display_name
                 channel = avchan
                 server = aserver
             elif (bvchan is not None and avchan is None):
                 # went offline
-                text = "{} has left the channel".format(before.display_name)
+                kind = "left"
+                name = before.display_name
                 channel = bvchan
                 server = bserver
             else:
                 return
             if not self.settings["allow_emoji"]:
-                text = emoji_pattern.sub(r'', text)
-            tts = gTTS(text=text, lang=self.settings["locale"])
-            tts.save(self.save_path + "/temp_message.mp3")
-            await self.sound_play(server, channel, self.save_path + "/temp_message.mp3")
+                name = emoji_pattern.sub(r'', name)
+            self.announce(server, channel, kind, name)
 
     @checks.admin_or_permissions(manage_server=True)
     @commands.command(pass_context=True, no_pm=True, name='seals')
@@ -186,8 +398,8 @@ class OnJoin:
         """For when it's time to put someone in their place."""
         server = ctx.message.author.server
         channel = ctx.message.author.voice_channel
-        await self.sound_play(server, channel,
-                              self.save_path + "/seals.mp3")
+        if not self.announce(server, channel, "sound", self.save_path + "/seals.mp3"):
+            await self.bot.say("The announcement queue is full, try again in a moment.")
 
     @checks.admin_or_permissions(manage_server=True)
     @commands.command(pass_context=True, no_pm=True, name='say')
@@ -195,9 +407,100 @@ class OnJoin:
         """Have the bot use TTS say a string in the current voice channel."""
         server = ctx.message.author.server
         channel = ctx.message.author.voice_channel
-        tts = gTTS(text=message, lang=self.settings["locale"])
-        tts.save(self.save_path + "/temp_message.mp3")
-        await self.sound_play(server, channel, self.save_path + "/temp_message.mp3")
+        if not self.announce(server, channel, "say", message):
+            await self.bot.say("The announcement queue is full, try again in a moment.")
+
+    @checks.admin_or_permissions(manage_server=True)
+    @commands.group(pass_context=True, no_pm=True, name='tts')
+    async def tts(self, ctx: commands.Context):
+        """Manage the TTS announcements."""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+
+    @tts.group(pass_context=True, name='cache')
+    async def tts_cache_group(self, ctx: commands.Context):
+        """Manage the cache of synthesized TTS clips."""
+        if ctx.invoked_subcommand is None:
+            await send_cmd_help(ctx)
+
+    @tts_cache_group.command(pass_context=False, name='stats')
+    async def tts_cache_stats(self):
+        """Show the TTS cache hit rate and disk usage."""
+        cache = self.tts_cache
+        lookups = cache.stats["hits"] + cache.stats["misses"]
+        hit_rate = cache.stats["hits"] / lookups if lookups else 0
+        await self.bot.say(
+            "```\nClips: {}\nDisk usage: {:.2f} / {:.0f} MiB\nHits: {}\nMisses: {}\n"
+            "Hit rate: {:.1%}\nEvictions: {}\n```".format(
+                len(cache.clips), cache.size / 1024 ** 2, cache.max_bytes / 1024 ** 2,
+                cache.stats["hits"], cache.stats["misses"], hit_rate, cache.stats["evictions"]))
+
+    @tts.group(pass_context=True, name='queue', invoke_without_command=True)
+    async def tts_queue(self, ctx: commands.Context):
+        """Show this server's announcement queue."""
+        queue = self.queues.get(ctx.message.server.id)
+        stats = queue.stats if queue else Counter()
+        await self.bot.say(
+            "```\nWaiting: {}\nQueued: {}\nPlayed: {}\nFailed: {}\nCoalesced: {}\nDropped: {}\n"
+            "Depth: {}\nDrop policy: {}\n```".format(
+                len(queue.items) if queue else 0, stats["queued"], stats["played"], stats["failed"],
+                stats["coalesced"], stats["dropped"], self.settings["queue_depth"], self.settings["queue_drop"]))
+
+    @tts_queue.command(pass_context=False, name='depth')
+    async def tts_queue_depth(self, depth: int):
+        """Change how many announcements may wait in a server's queue."""
+        if depth < 1:
+            await self.bot.say("The queue must hold at least 1 announcement.")
+            return
+        self.settings["queue_depth"] = depth
+        dataIO.save_json("data/on_join/settings.json", self.settings)
+        for queue in self.queues.values():
+            queue.depth = depth
+        await self.bot.say("Up to {} announcements may now wait per server.".format(depth))
+
+    @tts_queue.command(pass_context=False, name='drop')
+    async def tts_queue_drop(self, policy: str):
+        """Choose whether a full queue drops its oldest or the newest announcement."""
+        policy = policy.lower()
+        if policy not in QUEUE_DROP_POLICIES:
+            await self.bot.say("Please specify 'oldest' or 'newest'.")
+            return
+        self.settings["queue_drop"] = policy
+        dataIO.save_json("data/on_join/settings.json", self.settings)
+        for queue in self.queues.values():
+            queue.policy = policy
+        await self.bot.say("A full queue now drops the {} announcement.".format(policy))
+
+    @tts.command(pass_context=False, name='backend')
+    async def tts_backend(self, name: str):
+        """Change the engine used to synthesize speech."""
+        name = name.lower()
+        if name not in TTS_BACKENDS:
+            await self.bot.say("Available backends: {}".format(", ".join(sorted(TTS_BACKENDS))))
+            return
+        self.settings["tts_backend"] = name
+        dataIO.save_json("data/on_join/settings.json", self.settings)
+        self.tts_cache.backend_name = name
+        self.tts_cache.backend = TTS_BACKENDS[name]()
+        await self.bot.say("Speech will now be synthesized with {}.".format(name))
+
+    @tts_cache_group.command(pass_context=False, name='size')
+    async def tts_cache_size(self, megabytes: int):
+        """Change how much disk space the TTS cache may use."""
+        if megabytes < 1:
+            await self.bot.say("The cache needs at least 1 MiB.")
+            return
+        self.settings["tts_cache_mb"] = megabytes
+        dataIO.save_json("data/on_join/settings.json", self.settings)
+        self.tts_cache.max_bytes = megabytes * 1024 ** 2
+        self.tts_cache.evict()
+        await self.bot.say("The TTS cache may now use {} MiB.".format(megabytes))
+
+    @tts_cache_group.command(pass_context=False, name='clear')
+    async def tts_cache_clear(self):
+        """Delete every cached TTS clip."""
+        self.tts_cache.clear()
+        await self.bot.say("The TTS cache was cleared.")
 
     @checks.admin_or_permissions(manage_server=True)
     @commands.command(pass_context=False, no_pm=True, name='set_locale')
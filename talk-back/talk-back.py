@@ -1,4 +1,6 @@
 import asyncio
+import os
+import tempfile
 
 import discord
 import speech_recognition as sr
@@ -6,68 +8,6 @@ from discord.ext import commands
 from gtts import gTTS
 
 
-class SoundPlayer:
-    def __init__(self, bot):
-        self.bot = bot
-        self.audio_players = {}
-
-    def voice_channel_full(self, voice_channel: discord.Channel) -> bool:
-        return (voice_channel.user_limit != 0 and
-                len(voice_channel.voice_members) >= voice_channel.user_limit)
-
-    def voice_connected(self, server: discord.Server) -> bool:
-        return self.bot.is_voice_connected(server)
-
-    def voice_client(self, server: discord.Server) -> discord.VoiceClient:
-        return self.bot.voice_client_in(server)
-
-    async def _leave_voice_channel(self, server: discord.Server):
-        if not self.voice_connected(server):
-            return
-        voice_client = self.voice_client(server)
-
-        if server.id in self.audio_players:
-            self.audio_players[server.id].stop()
-        await voice_client.disconnect()
-
-    async def wait_for_disconnect(self, server: discord.Server):
-        while not self.audio_players[server.id].is_done():
-            await asyncio.sleep(0.01)
-        await self._leave_voice_channel(server)
-
-    async def sound_init(self, server: discord.Server, path: str):
-        options = "-filter \"volume=volume=1.00\""
-        voice_client = self.voice_client(server)
-        self.audio_players[server.id] = voice_client.create_ffmpeg_player(
-            path, options=options)
-
-    async def sound_play(self, server: discord.Server,
-                         channel: discord.Channel, p: str):
-        if self.voice_channel_full(channel):
-            return
-
-        if not channel.is_private:
-            if self.voice_connected(server):
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-            else:
-                await self.bot.join_voice_channel(channel)
-                if server.id not in self.audio_players:
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-                else:
-                    if self.audio_players[server.id].is_playing():
-                        self.audio_players[server.id].stop()
-                    await self.sound_init(server, p)
-                    self.audio_players[server.id].start()
-
-
 class TalkBack:
     def __init__(self, bot):
         self.bot = bot
@@ -75,10 +15,17 @@ class TalkBack:
         self.recognizer = sr.Recognizer()
 
     async def speak(self, audio_string, ctx):
-        sp = SoundPlayer(self.bot)
-        tts = gTTS(text=audio_string, lang='en')
-        tts.save("audio.mp3")
-        await sp.sound_play(ctx.message.server, ctx.message.author.voice_channel, "audio.mp3")
+        player = self.bot.get_cog("VoicePlayer")
+        if player is None:
+            print("talk-back: load the voice_player cog to speak")
+            return
+        fd, path = tempfile.mkstemp(suffix=".mp3")
+        os.close(fd)
+        try:
+            await self.bot.loop.run_in_executor(None, gTTS(text=audio_string, lang='en').save, path)
+            await player.play(ctx.message.server, ctx.message.author.voice_channel, path)
+        finally:
+            os.remove(path)
 
     def record_audio(self):
         with sr.Microphone() as source:
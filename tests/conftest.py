@@ -0,0 +1,31 @@
+"""Loads cogs the way Red does, as modules of its cogs package.
+
+The tests need a Red v2 install on the path (for cogs.utils) along with the
+cogs' own requirements; without them they are skipped."""
+import importlib.util
+import os
+import sys
+
+import __main__
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _send_cmd_help(ctx):
+    pass
+
+
+def load_cog(folder):
+    """Imports folder/folder.py as cogs.<folder>, or skips the calling test module"""
+    pytest.importorskip("discord")
+    pytest.importorskip("cogs.utils.dataIO")
+    if not hasattr(__main__, "send_cmd_help"):
+        __main__.send_cmd_help = _send_cmd_help
+    name = "cogs.{}".format(folder.replace("-", "_"))
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, folder, folder + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
@@ -0,0 +1,99 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from conftest import ROOT, load_cog
+
+armorsmith = load_cog("armorsmith")
+
+
+@pytest.mark.parametrize("expression", ["0d6", "0d6+3", "-2", "1d8-10", "2d4-3 adv"])
+def test_parse_rejects_empty_and_negative_rolls(expression):
+    with pytest.raises(ValueError):
+        armorsmith.Dice.parse(expression)
+
+
+@pytest.mark.parametrize("expression,lowest", [("1d8-1", 0), ("1", 1), ("0", 0), ("2d6+2", 4), ("1d6!", 1)])
+def test_parse_accepts_rolls_of_at_least_zero(expression, lowest):
+    dice = armorsmith.Dice.parse(expression)
+    assert dice.count + dice.modifier == lowest
+
+
+def test_catalog_rejects_dice_that_can_heal(tmp_path):
+    items = tmp_path / "items.json"
+    items.write_text(json.dumps({"weapons_list": [{"name": "Wet Noodle", "cost": 1, "hit_dice": "1d8-10"}]}))
+    with pytest.raises(armorsmith.CatalogError):
+        armorsmith.Catalog.load(str(items), 1)
+
+
+def shipped_loadout(weapon, armor=None, potion=None):
+    """A loadout built from items in the shipped items.json"""
+    catalog = armorsmith.Catalog.load(os.path.join(ROOT, "armorsmith", "data", "items.json"), 1)
+    return armorsmith.Loadout.from_equipment(*(catalog.index.exact(catalog.index.normalize(name))
+                                               if name else None for name in (weapon, armor, potion)))
+
+
+# The slowest odds among shipped items: hits that barely get through armor, and potions dragging duels out
+SLOW_MATCHUPS = [
+    (("Club", "Chainmail Armor", "Giant Healing Potion"), ("Dagger", "Chainmail Armor", "Giant Healing Potion")),
+    (("Blowgun", "Chainmail Armor", "Giant Healing Potion"), ("Club", "Chainmail Armor", "Giant Healing Potion")),
+    (("Greatsword", "Chainmail Armor", None), ("Maul", "Chainmail Armor", None)),
+]
+
+
+@pytest.mark.parametrize("author,user", SLOW_MATCHUPS)
+def test_odds_are_well_under_100_ms(author, user):
+    author, user = shipped_loadout(*author), shipped_loadout(*user)
+    best = float("inf")
+    for seed in range(3):
+        start = time.perf_counter()
+        armorsmith.simulate_duels(author, user, 50, armorsmith.ODDS_SIMULATIONS, np.random.default_rng(seed))
+        best = min(best, time.perf_counter() - start)
+    assert best < 0.1
+
+
+@pytest.mark.parametrize("author,user", SLOW_MATCHUPS + [
+    (("Excalibur", None, "Small Healing Potion"), ("Crossbow, light", "Leather Armor", "Large Healing Potion")),
+])
+def test_odds_agree_with_fought_duels(author, user):
+    author, user = shipped_loadout(*author), shipped_loadout(*user)
+    simulated = armorsmith.simulate_duels(author, user, 50, 100000, np.random.default_rng(0)).mean()
+    (hp_author, hp_user), _ = armorsmith._fight(author, user, 50, 20000, np.random.default_rng(1))
+    fought = ((hp_user <= 0) | ((hp_author > 0) & (hp_author > hp_user))).mean()
+    assert abs(simulated - fought) < 0.02
+
+
+class FlakyWriter(armorsmith.WriteBehind):
+    """Fails its first save with an unexpected error, then records every save"""
+
+    def __init__(self, bot):
+        self.saves = []
+        super().__init__(bot, interval=0.01)
+
+    async def _persist(self):
+        if not self.saves:
+            self.saves.append("failed")
+            raise ValueError("not serializable")
+        self.saves.append("saved")
+
+
+def test_flush_loop_survives_unexpected_errors(monkeypatch):
+    monkeypatch.setattr(armorsmith, "logger", logging.getLogger("test.armorsmith"), raising=False)
+    loop = asyncio.new_event_loop()
+    try:
+        writer = FlakyWriter(SimpleNamespace(loop=loop))
+        writer.mark_dirty()
+        loop.run_until_complete(asyncio.sleep(0.1))
+        assert writer.saves == ["failed", "saved"]
+        assert not writer._task.done()
+        assert writer.dirty == 0
+        writer.close()
+        loop.run_until_complete(asyncio.gather(writer._task, return_exceptions=True))
+    finally:
+        loop.close()
@@ -0,0 +1,30 @@
+import asyncio
+
+from conftest import load_cog
+
+voice_player = load_cog("voice_player")
+
+
+def test_concurrent_misses_share_one_decode(tmp_path, monkeypatch):
+    clip = tmp_path / "clip.mp3"
+    clip.write_bytes(b"mp3")
+    decodes = []
+
+    def decode_pcm(path, use_avconv=False):
+        decodes.append(path)
+        return bytes(voice_player.FRAME_BYTES)
+
+    async def play_together():
+        return await asyncio.gather(*(cache.get(str(clip), always=True) for _ in range(5)))
+
+    monkeypatch.setattr(voice_player, "decode_pcm", decode_pcm)
+    loop = asyncio.new_event_loop()
+    try:
+        cache = voice_player.PcmCache(loop, 1024 ** 2)
+        clips = loop.run_until_complete(play_together())
+    finally:
+        loop.close()
+    assert len(decodes) == 1
+    assert all(pcm == bytes(voice_player.FRAME_BYTES) for pcm in clips)
+    assert cache.size == voice_player.FRAME_BYTES
+    assert not cache.pending
@@ -0,0 +1,273 @@
+import asyncio
+import os
+import shlex
+import subprocess
+from collections import Counter, OrderedDict, defaultdict
+from io import BytesIO
+
+import discord
+from discord.ext import commands
+
+from .utils import checks
+from .utils.chat_formatting import box
+from .utils.dataIO import dataIO
+
+SETTINGS_PATH = "data/voice_player/settings.json"
+DEFAULTS = {
+    "IDLE_DISCONNECT": 300,
+    "PCM_CACHE_MB": 64
+}
+FFMPEG_OPTIONS = "-filter \"volume=volume=1.00\""
+PLAYBACK_TIMEOUT = 60
+# 20 ms of 48 kHz 16-bit stereo, the size of every read of discord's stream player
+FRAME_BYTES = 3840
+PCM_CACHE_AFTER = 2
+
+
+def ffmpeg_args(path, use_avconv=False):
+    """The decode that create_ffmpeg_player runs: 48 kHz 16-bit stereo PCM on stdout"""
+    return (["avconv" if use_avconv else "ffmpeg", "-i", path, "-f", "s16le", "-ar", "48000", "-ac", "2",
+             "-loglevel", "warning"] + shlex.split(FFMPEG_OPTIONS) + ["pipe:1"])
+
+
+def decode_pcm(path, use_avconv=False):
+    """Decodes a whole clip to PCM, padded with silence to whole frames"""
+    pcm = subprocess.run(ffmpeg_args(path, use_avconv), stdout=subprocess.PIPE,
+                         stderr=subprocess.DEVNULL, check=True).stdout
+    if len(pcm) % FRAME_BYTES:
+        pcm += bytes(FRAME_BYTES - len(pcm) % FRAME_BYTES)
+    return pcm
+
+
+class PcmCache:
+    """Clips decoded once to PCM and kept in memory, up to max_bytes.
+
+    A clip is decoded on its PCM_CACHE_AFTER-th play, or on its first if the
+    caller asks for it. Entries are keyed by path, modification time and size,
+    so an edited file is decoded again, and the least recently played are
+    dropped first. Plays of a clip that is being decoded wait for that decode
+    instead of starting another."""
+
+    def __init__(self, loop, max_bytes):
+        self.loop = loop
+        self.max_bytes = max_bytes
+        self.clips = OrderedDict()
+        self.size = 0
+        self.plays = Counter()
+        self.pending = {}
+        self.stats = Counter()
+
+    async def get(self, path, use_avconv=False, always=False):
+        """Returns the clip's PCM, or None if it should be played through ffmpeg"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, stat.st_mtime, stat.st_size)
+        pcm = self.clips.get(key)
+        if pcm is not None:
+            self.stats["hits"] += 1
+            self.clips.move_to_end(key)
+            return pcm
+        pending = self.pending.get(key)
+        if pending is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(pending)
+        self.stats["misses"] += 1
+        self.plays[key] += 1
+        if not always and self.plays[key] < PCM_CACHE_AFTER:
+            return None
+        pending = self.loop.create_task(self.decode(key, path, use_avconv))
+        self.pending[key] = pending
+        pending.add_done_callback(lambda _: self.pending.pop(key, None))
+        return await asyncio.shield(pending)
+
+    async def decode(self, key, path, use_avconv):
+        try:
+            pcm = await self.loop.run_in_executor(None, decode_pcm, path, use_avconv)
+        except (OSError, subprocess.CalledProcessError) as e:
+            print("voice_player: couldn't decode {}: {}".format(path, e))
+            self.stats["failed decodes"] += 1
+            return None
+        self.stats["decodes"] += 1
+        del self.plays[key]
+        if len(pcm) <= self.max_bytes:
+            self.clips[key] = pcm
+            self.size += len(pcm)
+            self.evict()
+        return pcm
+
+    def evict(self):
+        while self.size > self.max_bytes:
+            _, pcm = self.clips.popitem(last=False)
+            self.size -= len(pcm)
+            self.stats["evictions"] += 1
+
+
+class ServerVoice:
+    """The playback state of one server"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.player = None
+        self.idle_timer = None
+
+
+class VoicePlayer:
+    """Plays audio clips in voice channels on behalf of other cogs.
+
+    Cogs get it with bot.get_cog("VoicePlayer") and await play(), which
+    returns once the clip has finished. Each server has one voice connection
+    and plays one clip at a time; the connection is kept between clips and
+    closed after IDLE_DISCONNECT seconds without any. Static and frequently
+    played clips are streamed from a PcmCache instead of spawning ffmpeg."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.settings = dict(DEFAULTS, **dataIO.load_json(SETTINGS_PATH))
+        self.servers = defaultdict(ServerVoice)
+        self.stats = Counter()
+        self.pcm = PcmCache(bot.loop, self.settings["PCM_CACHE_MB"] * 1024 ** 2)
+
+    def __unload(self):
+        for state in self.servers.values():
+            if state.idle_timer is not None:
+                state.idle_timer.cancel()
+            if state.player is not None:
+                state.player.stop()
+
+    def voice_channel_full(self, voice_channel: discord.Channel) -> bool:
+        return (voice_channel.user_limit != 0 and
+                len(voice_channel.voice_members) >= voice_channel.user_limit)
+
+    def voice_client(self, server: discord.Server) -> discord.VoiceClient:
+        return self.bot.voice_client_in(server)
+
+    async def connect(self, server: discord.Server, channel: discord.Channel) -> discord.VoiceClient:
+        voice_client = self.voice_client(server)
+        if voice_client is None:
+            voice_client = await self.bot.join_voice_channel(channel)
+            self.stats["connects"] += 1
+        elif voice_client.channel != channel:
+            await voice_client.move_to(channel)
+            self.stats["moves"] += 1
+        return voice_client
+
+    async def play(self, server: discord.Server, channel: discord.Channel, path: str,
+                   use_avconv: bool = False, interrupt: bool = False, static: bool = False) -> bool:
+        """Plays the clip at path in channel and returns once it has finished.
+
+        Clips for the same server wait for the one before them, unless
+        interrupt is set, which stops the clip playing now. static clips are
+        kept in memory from their first play. Returns False if the clip
+        couldn't be played there."""
+        if channel is None or channel.is_private:
+            return False
+        voice_client = self.voice_client(server)
+        if self.voice_channel_full(channel) and (voice_client is None or voice_client.channel != channel):
+            return False
+
+        pcm = await self.pcm.get(path, use_avconv, always=static)
+        state = self.servers[server.id]
+        if interrupt and state.player is not None:
+            state.player.stop()
+        async with state.lock:
+            if state.idle_timer is not None:
+                state.idle_timer.cancel()
+                state.idle_timer = None
+            voice_client = await self.connect(server, channel)
+            done = asyncio.Event()
+            after = lambda: self.bot.loop.call_soon_threadsafe(done.set)
+            if pcm is not None:
+                state.player = voice_client.create_stream_player(BytesIO(pcm), after=after)
+                self.stats["clips from memory"] += 1
+            else:
+                state.player = voice_client.create_ffmpeg_player(
+                    path, options=FFMPEG_OPTIONS, use_avconv=use_avconv, after=after)
+            state.player.start()
+            self.stats["clips"] += 1
+            try:
+                await asyncio.wait_for(done.wait(), PLAYBACK_TIMEOUT)
+            except asyncio.TimeoutError:
+                state.player.stop()
+                self.stats["timeouts"] += 1
+            state.player = None
+            self.schedule_disconnect(server)
+        return True
+
+    def schedule_disconnect(self, server: discord.Server):
+        idle = self.settings["IDLE_DISCONNECT"]
+        if idle > 0:
+            self.servers[server.id].idle_timer = self.bot.loop.call_later(
+                idle, lambda: self.bot.loop.create_task(self.disconnect(server)))
+
+    async def disconnect(self, server: discord.Server):
+        state = self.servers[server.id]
+        state.idle_timer = None
+        if state.lock.locked():
+            return
+        voice_client = self.voice_client(server)
+        if voice_client is not None:
+            await voice_client.disconnect()
+            self.stats["idle disconnects"] += 1
+
+    @checks.admin_or_permissions(manage_server=True)
+    @commands.group(pass_context=True, name='voiceplayer')
+    async def voiceplayer(self, ctx: commands.Context):
+        """Shows voice playback status and settings."""
+        if ctx.invoked_subcommand is None:
+            connected = sum(self.voice_client(server) is not None for server in self.bot.servers)
+            playing = sum(state.player is not None for state in self.servers.values())
+            msg = "Connected servers: {}\nPlaying: {}\nIdle disconnect: {}s\n".format(
+                connected, playing, self.settings["IDLE_DISCONNECT"])
+            for stat in ("clips", "clips from memory", "connects", "moves", "idle disconnects", "timeouts"):
+                msg += "{}: {}\n".format(stat.capitalize(), self.stats[stat])
+            lookups = self.pcm.stats["hits"] + self.pcm.stats["misses"]
+            msg += "PCM cache: {} clips, {:.1f} / {} MiB, {:.1%} hit rate\n".format(
+                len(self.pcm.clips), self.pcm.size / 1024 ** 2, self.settings["PCM_CACHE_MB"],
+                self.pcm.stats["hits"] / lookups if lookups else 0)
+            msg = box(msg) + "\nSee {}help voiceplayer to edit the settings".format(ctx.prefix)
+            await self.bot.say(msg)
+
+    @voiceplayer.command(name='idle')
+    async def voiceplayer_idle(self, seconds: int):
+        """Seconds of silence before leaving the voice channel, 0 to stay."""
+        if seconds < 0:
+            await self.bot.say("Seconds can't be negative.")
+            return
+        self.settings["IDLE_DISCONNECT"] = seconds
+        dataIO.save_json(SETTINGS_PATH, self.settings)
+        if seconds:
+            await self.bot.say("I'll leave voice channels after {} seconds of silence.".format(seconds))
+        else:
+            await self.bot.say("I'll stay in voice channels after playing.")
+
+    @voiceplayer.command(name='cachesize')
+    async def voiceplayer_cachesize(self, megabytes: int):
+        """MiB of memory for decoded clips, 0 to always use ffmpeg."""
+        if megabytes < 0:
+            await self.bot.say("The cache size can't be negative.")
+            return
+        self.settings["PCM_CACHE_MB"] = megabytes
+        dataIO.save_json(SETTINGS_PATH, self.settings)
+        self.pcm.max_bytes = megabytes * 1024 ** 2
+        self.pcm.evict()
+        await self.bot.say("Decoded clips may now use {} MiB of memory.".format(megabytes))
+
+
+def check_folders():
+    if not os.path.exists("data/voice_player"):
+        print("Creating data/voice_player folder...")
+        os.makedirs("data/voice_player")
+
+
+def check_files():
+    if not dataIO.is_valid_json(SETTINGS_PATH):
+        print("Creating default voice_player settings.json...")
+        dataIO.save_json(SETTINGS_PATH, DEFAULTS)
+
+
+def setup(bot):
+    check_folders()
+    check_files()
+    bot.add_cog(VoicePlayer(bot))